@@ -0,0 +1,93 @@
+# Benchmark: throughput of reactive commands sent to a stand-in event manager
+# (see em.py), with a new connection for each command and with persistent
+# connections (see reactivetools/connpool.py)
+#
+# Usage: python benchmarks/connpool.py [--commands 5000] [--concurrency 64]
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from em import EventManager, make_deployed_descriptor
+
+
+async def run(args, file, max_connections):
+    from reactivetools import config, connpool, glob
+
+    pool = None
+    if max_connections is not None:
+        pool = connpool.ConnectionPool(max_connections)
+    glob.set_connection_pool(pool)
+
+    em = EventManager()
+    em_server = await em.start(port=args.port)
+
+    conf = config.load(file, limits={"node": args.concurrency})
+    modules = conf.modules
+    connections = conf.connections
+
+    # half calls (with a response), half outputs (without)
+    async def send(i):
+        if i % 2 == 0:
+            await modules[i % len(modules)].call("entry", b'\xbe\xef')
+        else:
+            conn = connections[i % len(connections)]
+            await conn.to_module.node.output(conn, b'\xbe\xef', nonce=i)
+
+    queue = iter(range(args.commands))
+
+    async def worker():
+        for i in queue:
+            await send(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+
+    if pool is not None:
+        await pool.close()
+
+    em_server.close()
+    await em_server.wait_closed()
+
+    name = "new connection per command" if pool is None else \
+           "persistent connections (max {})".format(max_connections)
+    print("{}: {} commands, concurrency {}: {:.0f} commands/s".format(
+            name, args.commands, args.concurrency, args.commands / elapsed))
+    print("  event manager received {} commands on {} connections".format(
+            em.commands, em.connections))
+    if pool is not None:
+        print("  pool: {}".format(pool.stats))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commands', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--modules', type=int, default=4)
+    parser.add_argument('--connections', type=int, default=4,
+                        help='maximum number of persistent connections')
+    parser.add_argument('--port', type=int, default=5125)
+    args = parser.parse_args()
+
+    dir = tempfile.mkdtemp()
+    os.chdir(dir)
+    os.mkdir("build")
+    file = os.path.join(dir, "descriptor.json")
+
+    from reactivetools.descriptor import DescriptorType
+    DescriptorType.JSON.dump(file, make_deployed_descriptor(args.port, args.modules))
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(args, file, None))
+    loop.run_until_complete(run(args, file, args.connections))
+
+
+if __name__ == "__main__":
+    main()
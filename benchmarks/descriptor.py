@@ -0,0 +1,63 @@
+# Benchmark: load/dump times of large deployment descriptors for each
+# DescriptorType, compared with the pure-Python YAML loader/dumper
+#
+# Usage: python benchmarks/descriptor.py [--modules 2000]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from load_config import make_descriptor, timeit
+from reactivetools.descriptor import DescriptorType, _import_yaml
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    contents = make_descriptor(args.modules)
+    dir = tempfile.mkdtemp()
+
+    _, loader, dumper = _import_yaml()
+    print("YAML loader: {}, dumper: {}".format(
+            loader.__name__, dumper.__mro__[1].__name__))
+    print("{:>16} {:>10} {:>10} {:>10}".format(
+            "format", "size(KB)", "dump(s)", "load(s)"))
+
+    for type in DescriptorType:
+        file = os.path.join(dir, "descriptor.{}".format(type.name.lower()))
+
+        t_dump = timeit(lambda: type.dump(file, contents), args.repeat)
+        t_load = timeit(lambda: DescriptorType.load_any(file), args.repeat)
+
+        print("{:>16} {:>10} {:>10.4f} {:>10.4f}".format(
+                type.name, os.path.getsize(file) // 1024, t_dump, t_load))
+
+    # reference: pure-Python YAML, as used before
+    file = os.path.join(dir, "descriptor.yaml")
+
+    def dump_py():
+        with open(file, 'w') as f:
+            yaml.dump(contents, f, Dumper=yaml.Dumper)
+
+    def load_py():
+        with open(file, 'r') as f:
+            yaml.load(f, Loader=yaml.FullLoader)
+
+    t_dump = timeit(dump_py, args.repeat)
+    t_load = timeit(load_py, args.repeat)
+
+    print("{:>16} {:>10} {:>10.4f} {:>10.4f}".format(
+            "YAML (pure py)", os.path.getsize(file) // 1024, t_dump, t_load))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Stand-in event manager, used by the benchmarks to measure the overhead of
+# reactive-tools without real nodes
+#
+# It accepts any reactive command on a TCP port and, if the command expects a
+# response, answers with ReactiveResult.Ok and an empty payload. Multiple
+# commands can be sent over the same connection.
+#
+# Usage: python benchmarks/em.py [--port 5000]
+
+import argparse
+import asyncio
+
+from reactivenet import CommandMessage, ResultMessage, Message, ReactiveResult
+
+
+class EventManager:
+    def __init__(self):
+        self.commands = 0
+        self.connections = 0
+
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+
+        try:
+            while True:
+                command = await CommandMessage.read(reader)
+                self.commands += 1
+
+                if command.has_response():
+                    writer.write(ResultMessage(ReactiveResult.Ok, Message()).pack())
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+    async def start(self, host="127.0.0.1", port=5000):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def serve(port):
+    server = await EventManager().start(port=port)
+    async with server:
+        await server.serve_forever()
+
+
+# Deployment descriptor of an already deployed and attested native module,
+# listening on `port`, with an entry point and a direct connection
+def make_deployed_descriptor(port, n_modules=1):
+    key = "00" * 16
+    data = {
+        "inputs": {"input": 0},
+        "outputs": {},
+        "entrypoints": {"entry": 2},
+        "handlers": {},
+        "requests": {}
+    }
+
+    modules = [{
+        "type": "native",
+        "name": "sm{}".format(i),
+        "node": "node",
+        "deployed": True,
+        "attested": True,
+        "id": i + 1,
+        "binary": "sm{}".format(i),
+        "key": key,
+        "data": data
+    } for i in range(n_modules)]
+
+    connections = [{
+        "name": "conn{}".format(i),
+        "direct": True,
+        "to_module": "sm{}".format(i),
+        "to_input": "input",
+        "encryption": "aes",
+        "established": True,
+        "key": key,
+        "nonce": 0,
+        "id": i
+    } for i in range(n_modules)]
+
+    return {
+        "nodes": [{
+            "type": "native",
+            "name": "node",
+            "ip_address": "127.0.0.1",
+            "reactive_port": port
+        }],
+        "modules": modules,
+        "connections": connections
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.port))
@@ -0,0 +1,97 @@
+# Benchmark: time needed to validate and load deployment descriptors of
+# increasing size, to check that config.load scales (nearly) linearly
+#
+# Usage: python benchmarks/load_config.py [--sizes 100 1000 2000 10000]
+#
+# Synthetic descriptors are made of native nodes and modules, each module
+# having an outgoing connection to the next one and a periodic event.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def make_descriptor(n_modules, modules_per_node=50):
+    n_nodes = max(1, n_modules // modules_per_node)
+
+    nodes = [{
+        "type": "native",
+        "name": "node{}".format(i),
+        "ip_address": "127.0.0.1",
+        "reactive_port": 5000 + i
+    } for i in range(n_nodes)]
+
+    modules = [{
+        "type": "native",
+        "name": "sm{}".format(i),
+        "node": "node{}".format(i % n_nodes)
+    } for i in range(n_modules)]
+
+    connections = [{
+        "from_module": "sm{}".format(i),
+        "from_output": "output",
+        "to_module": "sm{}".format((i + 1) % n_modules),
+        "to_input": "input",
+        "encryption": "aes"
+    } for i in range(n_modules)]
+
+    events = [{
+        "module": "sm{}".format(i),
+        "entry": "entry",
+        "frequency": 1000
+    } for i in range(n_modules)]
+
+    return {
+        "nodes": nodes,
+        "modules": modules,
+        "connections": connections,
+        "periodic-events": events
+    }
+
+
+def timeit(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 1000, 2000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # modules create their build dir under the current working directory
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir("build")
+
+    from reactivetools import config
+    from reactivetools.descriptor import DescriptorType
+
+    print("{:>8} {:>12} {:>12} {:>12}".format(
+            "modules", "validate(s)", "load(s)", "us/module"))
+
+    for size in args.sizes:
+        file = "descriptor-{}.json".format(size)
+        DescriptorType.JSON.dump(file, make_descriptor(size))
+        contents, _ = DescriptorType.load_any(file)
+
+        t_validate = timeit(lambda: config.validate(contents), args.repeat)
+        t_load = timeit(lambda: config.load(file), args.repeat)
+
+        print("{:>8} {:>12.4f} {:>12.4f} {:>12.1f}".format(
+                size, t_validate, t_load, t_load / size * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Benchmark: throughput of the `serve` mode against a stand-in event manager
+# (see em.py), compared with one `reactive-tools` process per command
+#
+# Usage: python benchmarks/server.py [--requests 5000] [--clients 16]
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from em import EventManager, make_deployed_descriptor
+
+
+async def client(socket_path, requests, latencies):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+
+    for request in requests:
+        start = time.perf_counter()
+        writer.write((json.dumps(request) + "\n").encode())
+        await writer.drain()
+
+        result = json.loads(await reader.readline())
+        if not result["ok"]:
+            raise Exception(result["error"])
+
+        latencies.append(time.perf_counter() - start)
+
+    writer.close()
+
+
+async def run_server(args, dir, file):
+    from reactivetools import config, server
+
+    em = EventManager()
+    em_server = await em.start(port=args.port)
+
+    conf = config.load(file)
+    socket_path = os.path.join(dir, "server.sock")
+    srv = server.Server(conf, socket_path)
+    serve_task = asyncio.ensure_future(srv.serve())
+
+    while not os.path.exists(socket_path):
+        await asyncio.sleep(0.01)
+
+    # each client sends both calls and outputs on its own connection
+    per_client = args.requests // args.clients
+    requests = [[
+        {"command": "call", "module": "sm{}".format(c % args.modules), "entry": "entry", "arg": "beef"}
+        if i % 2 == 0 else
+        {"command": "output", "connection": "conn{}".format(c % args.modules), "arg": "beef"}
+        for i in range(per_client)] for c in range(args.clients)]
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(socket_path, r, latencies) for r in requests])
+    elapsed = time.perf_counter() - start
+
+    os.kill(os.getpid(), 15) # SIGTERM: stop the server, flushing the journal
+    await serve_task
+
+    em_server.close()
+    await em_server.wait_closed()
+
+    latencies.sort()
+    print("serve: {} requests, {} clients: {:.0f} req/s, latency p50 {:.2f} ms, p99 {:.2f} ms".format(
+            len(latencies), args.clients, len(latencies) / elapsed,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000))
+    print("event manager received {} commands on {} connections".format(
+            em.commands, em.connections))
+
+
+async def run_cli(args, dir, file):
+    em = EventManager()
+    em_server = await em.start(port=args.port)
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    cmd = [sys.executable, "-c",
+            "import sys; from reactivetools.cli import main; main(sys.argv[1:])",
+            "call", file, "--module", "sm0", "--entry", "entry", "--arg", "beef"]
+
+    loop = asyncio.get_event_loop()
+    start = time.perf_counter()
+    for _ in range(args.cli):
+        await loop.run_in_executor(None,
+                lambda: subprocess.run(cmd, env=env, cwd=dir, check=True))
+    elapsed = time.perf_counter() - start
+
+    em_server.close()
+    await em_server.wait_closed()
+
+    print("one process per command: {} requests: {:.0f} req/s".format(
+            args.cli, args.cli / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--modules', type=int, default=4)
+    parser.add_argument('--cli', type=int, default=20,
+                        help='number of commands to run as separate processes')
+    parser.add_argument('--port', type=int, default=5124)
+    args = parser.parse_args()
+
+    dir = tempfile.mkdtemp()
+    os.chdir(dir)
+    os.mkdir("build")
+    file = os.path.join(dir, "descriptor.json")
+
+    from reactivetools.descriptor import DescriptorType
+    DescriptorType.JSON.dump(file, make_deployed_descriptor(args.port, args.modules))
+
+    asyncio.get_event_loop().run_until_complete(run_server(args, dir, file))
+
+    if args.cli:
+        asyncio.get_event_loop().run_until_complete(run_cli(args, dir, file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# Benchmark: cold-start latency of reactive-tools
+#
+# 1) import time of the entry point (reactivetools.cli), from `-X importtime`
+# 2) wall-clock time of a whole `reactive-tools call` process, against a
+#    stand-in event manager (see em.py)
+#
+# The script fails if the median import time exceeds --budget (in ms), or if
+# a `call` on a native module imports any of the modules in HEAVY_MODULES, so
+# that regressions can be caught.
+#
+# Usage: python benchmarks/startup.py [--repeat 10] [--budget 150]
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from em import EventManager, make_deployed_descriptor
+
+# These should never be imported by a `call` on a native module
+HEAVY_MODULES = [
+    "elftools",
+    "Crypto",
+    "aiofile",
+    "reactivetools.modules.sancus",
+    "reactivetools.modules.sgx",
+    "reactivetools.nodes.sancus"
+]
+
+MAIN = "import sys; from reactivetools.cli import main; main(sys.argv[1:])"
+
+
+def run_importtime(code, args=[], cwd=None):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = time.perf_counter()
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", code] + args,
+                    stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                    env=env, cwd=cwd, check=True)
+    elapsed = time.perf_counter() - start
+
+    # format: "import time: <self us> | <cumulative us> | <indent><module>"
+    imports = {}
+    for line in res.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module = line[len("import time:"):].split("|")
+        imports[module.strip()] = int(cumulative_us)
+
+    return elapsed, imports
+
+
+async def run_call(args):
+    em = EventManager()
+    server = await em.start(port=args.port)
+
+    dir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(dir, "build"))
+    file = os.path.join(dir, "descriptor.json")
+
+    from reactivetools.descriptor import DescriptorType
+    DescriptorType.JSON.dump(file, make_deployed_descriptor(args.port))
+
+    call_args = ["call", file, "--module", "sm0", "--entry", "entry"]
+    loop = asyncio.get_event_loop()
+
+    times, imports = [], {}
+    for _ in range(args.repeat):
+        elapsed, imports = await loop.run_in_executor(None,
+                    lambda: run_importtime(MAIN, call_args, cwd=dir))
+        times.append(elapsed)
+
+    server.close()
+    await server.wait_closed()
+
+    return times, imports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--budget', type=float, default=150,
+                        help='maximum median import time of reactivetools.cli (ms)')
+    parser.add_argument('--port', type=int, default=5123)
+    args = parser.parse_args()
+
+    import_times = []
+    for _ in range(args.repeat):
+        _, imports = run_importtime("import reactivetools.cli")
+        import_times.append(imports["reactivetools.cli"] / 1000)
+
+    median_import = statistics.median(import_times)
+    print("import reactivetools.cli: median {:.1f} ms, min {:.1f} ms".format(
+            median_import, min(import_times)))
+
+    call_times, imports = asyncio.run(run_call(args))
+    print("reactive-tools call (whole process): median {:.1f} ms, min {:.1f} ms".format(
+            statistics.median(call_times) * 1000, min(call_times) * 1000))
+
+    print("slowest imports of reactive-tools call:")
+    top = sorted(imports.items(), key=lambda x: x[1], reverse=True)[:10]
+    for module, us in top:
+        print("  {:>8.1f} ms  {}".format(us / 1000, module))
+
+    ok = True
+
+    if median_import > args.budget:
+        print("FAIL: import time exceeds the budget of {} ms".format(args.budget))
+        ok = False
+
+    heavy = [m for m in imports if m.split(".")[0] in HEAVY_MODULES or m in HEAVY_MODULES]
+    if heavy:
+        print("FAIL: call imported heavy modules: {}".format(", ".join(heavy)))
+        ok = False
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
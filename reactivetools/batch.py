@@ -0,0 +1,120 @@
+import asyncio
+import binascii
+import json
+import logging
+import time
+
+# Batch mode of the `call` command
+#
+# Each input record is a JSON object on its own line:
+#   {"module": <name>, "entry": <entry point>, "arg": <hex, optional>}
+#
+# Calls are dispatched concurrently, except for those to nodes that need a
+# lock (e.g., Sancus), which are executed one at a time in input order.
+# A result is written as a JSON line as soon as each call completes:
+#   {"index": <record index>, "module": ..., "entry": ..., "ok": <bool>,
+#    "response": <hex>, "error": <message>, "latency_ms": <float>}
+
+
+class Error(Exception):
+    pass
+
+
+def read_records(f):
+    records = []
+
+    for i, line in enumerate(f):
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            record = json.loads(line)
+            record["module"], record["entry"]
+        except (ValueError, TypeError, KeyError):
+            raise Error("Bad record at line {}: {}".format(i + 1, line))
+
+        records.append(record)
+
+    return records
+
+
+async def call_batch(config, records, out, concurrency=64):
+    entry_ids = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = 0
+
+    # Entry IDs are resolved only once per (module, entry) in the whole batch
+    def get_entry_id(module, entry):
+        key = (module.name, entry)
+        if key not in entry_ids:
+            entry_ids[key] = asyncio.ensure_future(module.get_entry_id(entry))
+
+        return entry_ids[key]
+
+    async def call(index, record):
+        nonlocal failed
+        result = {
+            "index": index,
+            "module": record["module"],
+            "entry": record["entry"]
+        }
+
+        start = time.perf_counter()
+
+        try:
+            module = config.get_module(record["module"])
+            entry_id = await get_entry_id(module, str(record["entry"]))
+            arg = record.get("arg")
+            arg = None if arg is None else binascii.unhexlify(arg)
+
+            response = await module.node.call(module, str(entry_id), arg)
+
+            result["ok"] = response is not None
+            result["response"] = None if response is None else \
+                                    binascii.hexlify(response).decode('ascii')
+        except Exception as e:
+            logging.debug(e)
+            result["ok"] = False
+            result["error"] = str(e)
+
+        result["latency_ms"] = (time.perf_counter() - start) * 1000
+
+        if not result["ok"]:
+            failed += 1
+
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+
+    async def bounded_call(index, record):
+        async with semaphore:
+            await call(index, record)
+
+    async def call_in_order(calls):
+        for index, record in calls:
+            await bounded_call(index, record)
+
+    # Calls to nodes that need a lock are kept in order, on a single worker
+    ordered = {}
+    tasks = []
+
+    for index, record in enumerate(records):
+        node = _get_node(config, record)
+
+        if node is not None and node.need_lock:
+            ordered.setdefault(node, []).append((index, record))
+        else:
+            tasks.append(bounded_call(index, record))
+
+    tasks += [call_in_order(calls) for calls in ordered.values()]
+    await asyncio.gather(*tasks)
+
+    return failed
+
+
+def _get_node(config, record):
+    try:
+        return config.get_module(record["module"]).node
+    except Exception:
+        # the error is reported when the call is executed
+        return None
@@ -0,0 +1,317 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from . import tools
+
+# Content-addressed cache of build artifacts
+#
+# Each entry is a directory named after the key of a build, i.e., a hash of
+# everything its artifacts depend on: sources, inputs of the code generator,
+# toolchain version, flags, build mode, ... An entry contains the artifacts
+# (e.g., the binary of a module) and a `meta.json` file with their names and
+# some additional data (e.g., the output of the code generator).
+#
+# Entries are written to a temporary directory and then renamed, therefore the
+# same cache can be shared by different deployments and processes. When the
+# total size of the cache exceeds its limit, the least recently used entries
+# are evicted: using an entry updates its modification time.
+#
+# The cache can be backed by a remote cache (see remotecache.py), which is
+# looked up on local misses and updated with each new entry.
+
+DEFAULT_SIZE = 1 << 30 # 1 GiB
+
+# bump to invalidate the entries written by previous versions
+VERSION = 1
+
+META_FILE = "meta.json"
+TMP_PREFIX = ".tmp-"
+# temporary directories older than this (e.g., left by a killed process) are
+# removed on eviction
+TMP_MAX_AGE = 24 * 3600
+
+__toolchain_versions = {}
+
+
+class Error(Exception):
+    pass
+
+
+def default_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or \
+                    os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "reactive-tools")
+
+
+# Size in bytes, optionally with a K, M or G suffix (e.g., "512M")
+def parse_size(size):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    size = str(size).strip().upper()
+
+    try:
+        if size and size[-1] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+        return int(size)
+    except ValueError:
+        raise Error("Bad size: {}".format(size))
+
+
+async def toolchain_version(*commands):
+    """
+    Returns the output of `<command> --version` for each of the commands, to
+    be included in the keys of the builds using them, or None for commands
+    that do not support it. Results are cached for the whole process
+    """
+    versions = []
+
+    for cmd in commands:
+        if cmd not in __toolchain_versions:
+            try:
+                out, _ = await tools.run_async_output(cmd, "--version")
+                __toolchain_versions[cmd] = out.decode().strip()
+            except (tools.ProcessRunError, OSError) as e:
+                logging.debug("Cannot get the version of {}: {}".format(cmd, e))
+                __toolchain_versions[cmd] = None
+
+        versions.append(__toolchain_versions[cmd])
+
+    return versions
+
+
+def package_version(name):
+    from importlib import metadata
+
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+async def make_key(kind, values, files=(), trees=()):
+    """
+    Returns the key of a build of type `kind`, computed from:
+        - values: JSON-serializable dict (flags, build mode, ...)
+        - files: list of files whose content is hashed, in order
+        - trees: list of directories whose files are all hashed, together with
+                 their paths relative to the directory. Hidden files and
+                 `target` directories (build outputs of cargo) are skipped
+
+    Paths themselves are not part of the key, so that the same sources in
+    different workspaces have the same key.
+    """
+    return await tools.run_blocking(_make_key, kind, values, list(files),
+                                    list(trees))
+
+
+def _make_key(kind, values, files, trees):
+    h = hashlib.sha256()
+
+    def update(*items):
+        h.update(json.dumps(items, sort_keys=True, default=str).encode())
+
+    def update_file(path):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                h.update(chunk)
+
+    update("version", VERSION, "kind", kind, "values", values)
+
+    for i, path in enumerate(files):
+        update("file", i, os.path.getsize(path))
+        update_file(path)
+
+    for i, root in enumerate(trees):
+        for path in _walk(root):
+            update("tree", i, os.path.relpath(path, root), os.path.getsize(path))
+            update_file(path)
+
+    return h.hexdigest()
+
+
+def _walk(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        # sorted, so that the order does not depend on the file system
+        dirnames[:] = sorted(d for d in dirnames
+                                if not d.startswith('.') and d != "target")
+
+        for name in sorted(filenames):
+            if not name.startswith('.'):
+                yield os.path.join(dirpath, name)
+
+
+class BuildCache:
+    def __init__(self, path, max_size=DEFAULT_SIZE, remote=None):
+        """
+        path: directory of the cache, created if it does not exist
+        max_size: maximum total size of the entries, in bytes
+        remote: remote backend (e.g., remotecache.HTTPCache), or None
+        """
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self.remote = remote
+
+        os.makedirs(self.path, exist_ok=True)
+
+
+    async def fetch(self, key, dests):
+        """
+        Copies each artifact of the entry `key` to its destination in `dests`
+        (dict of artifact name -> path), and returns the data stored with
+        the entry.
+
+        Returns None if the entry does not exist (neither locally nor in the
+        remote cache), or if it was evicted while copying it.
+        """
+        data = await tools.run_blocking(self.__fetch, key, dests)
+
+        if data is None and self.remote is not None and \
+                await self.__fetch_remote(key):
+            data = await tools.run_blocking(self.__fetch, key, dests)
+
+        return data
+
+
+    async def store(self, key, artifacts, data=None):
+        """
+        Stores the artifacts (dict of artifact name -> path) and `data`
+        (JSON-serializable) in the entry `key`, then evicts the least recently
+        used entries if the cache is too large.
+
+        Failures are only logged: the build artifacts are still usable.
+        """
+        await tools.run_blocking(self.__store, key, artifacts, data)
+
+        if self.remote is not None:
+            await self.remote.upload(key, artifacts, data or {})
+
+
+    # Downloads the entry `key` from the remote cache to the local one
+    async def __fetch_remote(self, key):
+        try:
+            tmp = await tools.run_blocking(tempfile.mkdtemp, prefix=TMP_PREFIX,
+                                           dir=self.path)
+        except OSError as e:
+            logging.warning("Failed to write to the build cache: {}".format(e))
+            return False
+
+        entry = await self.remote.download(key, tmp)
+        if entry is None:
+            await tools.run_blocking(shutil.rmtree, tmp, ignore_errors=True)
+            return False
+
+        return await tools.run_blocking(self.__commit, key, tmp,
+                                        list(entry["files"]), entry["data"])
+
+
+    def __fetch(self, key, dests):
+        entry = os.path.join(self.path, key)
+
+        try:
+            with open(os.path.join(entry, META_FILE), 'r') as f:
+                meta = json.load(f)
+
+            for name, dest in dests.items():
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                # artifacts are copied and not linked, since tools might
+                # update the files in the build dir in place. They are copied
+                # to a temporary file first, so that dest is never incomplete
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest))
+                os.close(fd)
+                try:
+                    shutil.copy2(os.path.join(entry, name), tmp)
+                    os.replace(tmp, dest)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning("Bad build cache entry {}: {}".format(key, e))
+            return None
+
+        logging.debug("Build cache hit: {}".format(key))
+        return meta["data"]
+
+
+    def __store(self, key, artifacts, data):
+        entry = os.path.join(self.path, key)
+
+        if os.path.exists(entry):
+            return
+
+        try:
+            tmp = tempfile.mkdtemp(prefix=TMP_PREFIX, dir=self.path)
+        except OSError as e:
+            logging.warning("Failed to write to the build cache: {}".format(e))
+            return
+
+        try:
+            for name, path in artifacts.items():
+                shutil.copy2(path, os.path.join(tmp, name))
+        except OSError as e:
+            logging.warning("Failed to write to the build cache: {}".format(e))
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        self.__commit(key, tmp, list(artifacts), data or {})
+
+
+    # Turns `tmp`, containing the artifacts, into the entry `key`
+    def __commit(self, key, tmp, files, data):
+        entry = os.path.join(self.path, key)
+
+        try:
+            with open(os.path.join(tmp, META_FILE), 'w') as f:
+                json.dump({"files": files, "data": data}, f)
+
+            os.rename(tmp, entry)
+        except OSError as e:
+            # e.g., the same entry was stored in the meantime by another process
+            if not os.path.exists(entry):
+                logging.warning("Failed to write to the build cache: {}".format(e))
+            shutil.rmtree(tmp, ignore_errors=True)
+            return os.path.exists(entry)
+
+        logging.debug("Build cache store: {}".format(key))
+        self.__evict()
+        return True
+
+
+    def __evict(self):
+        entries = []
+        total = 0
+        now = time.time()
+
+        for d in os.scandir(self.path):
+            try:
+                mtime = d.stat().st_mtime
+
+                if d.name.startswith(TMP_PREFIX):
+                    if now - mtime > TMP_MAX_AGE:
+                        shutil.rmtree(d.path, ignore_errors=True)
+                    continue
+
+                size = sum(f.stat().st_size for f in os.scandir(d.path))
+            except OSError:
+                # evicted by another process in the meantime
+                continue
+
+            entries.append((mtime, size, d.path))
+            total += size
+
+        entries.sort()
+
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+
+            logging.debug("Build cache evict: {}".format(os.path.basename(path)))
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
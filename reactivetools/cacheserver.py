@@ -0,0 +1,170 @@
+import hashlib
+import http.server
+import json
+import logging
+import os
+import tempfile
+
+from .remotecache import OBJECT_RE, KEY_RE, NAME_RE, CHUNK_SIZE
+
+# Reference server of the remote build cache (see remotecache.py), storing
+# objects and entries in a directory: `reactive-tools cache-server <dir>`
+#
+# It is a separate module so that the HTTP server is only loaded by the
+# cache-server command.
+#
+# Objects and entries are write-once: an object is stored only if its content
+# matches its hash, and an entry only if it does not exist yet and all the
+# objects it references are stored and intact. Existing entries cannot be
+# replaced (409 Conflict).
+#
+# NOTE: there is no authentication, and cached binaries are signed and deployed
+#       by the clients: anyone who can reach the server can add entries,
+#       therefore it must only be bound to a trusted network.
+
+
+class CacheServer(http.server.ThreadingHTTPServer):
+    def __init__(self, path, host="localhost", port=8100):
+        self.path = os.path.abspath(path)
+        self.objects = os.path.join(self.path, "objects")
+        self.entries = os.path.join(self.path, "entries")
+
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.entries, exist_ok=True)
+
+        super().__init__((host, port), _Handler)
+
+
+    # Files are written to a temporary file and linked to their destination,
+    # so that concurrent readers never see partial content. Returns False if
+    # the destination already exists, which is never replaced
+    def write(self, dest, content):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest))
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+
+            os.link(tmp, dest)
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp)
+
+        return True
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                h.update(chunk)
+    except FileNotFoundError:
+        return None
+
+    return h.hexdigest()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = self.__get_path()
+        if path is None:
+            return
+
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            self.__reply(404)
+            return
+
+        self.__reply(200, content)
+
+
+    def do_PUT(self):
+        path = self.__get_path()
+        if path is None:
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        content = self.rfile.read(length)
+
+        error = self.__check(path, content)
+        if error is not None:
+            self.__reply(400, error.encode())
+            return
+
+        if self.server.write(path, content):
+            self.__reply(201)
+        elif self.__is_object(path):
+            # same hash, therefore same content
+            self.__reply(200)
+        else:
+            self.__reply(409, b"Entry already exists")
+
+
+    def log_message(self, format, *args):
+        logging.info("%s - %s", self.address_string(), format % args)
+
+
+    def __get_path(self):
+        parts = self.path.strip('/').split('/')
+
+        if len(parts) == 2 and parts[0] == "objects" and \
+                OBJECT_RE.match(parts[1]):
+            return os.path.join(self.server.objects, parts[1])
+
+        if len(parts) == 2 and parts[0] == "entries" and KEY_RE.match(parts[1]):
+            return os.path.join(self.server.entries, parts[1])
+
+        self.__reply(404)
+        return None
+
+
+    def __is_object(self, path):
+        return os.path.dirname(path) == self.server.objects
+
+
+    def __check(self, path, content):
+        if self.__is_object(path):
+            if hashlib.sha256(content).hexdigest() != os.path.basename(path):
+                return "Hash mismatch"
+            return None
+
+        if os.path.exists(path):
+            return None # rejected with 409 by do_PUT
+
+        try:
+            entry = json.loads(content)
+        except ValueError:
+            return "Bad entry"
+
+        if not isinstance(entry, dict) or set(entry) != {"files", "data"} or \
+                not isinstance(entry["files"], dict) or \
+                not isinstance(entry["data"], dict):
+            return "Bad entry"
+
+        for name, digest in entry["files"].items():
+            if not isinstance(name, str) or not NAME_RE.match(name) or \
+                    name.startswith('.'):
+                return "Bad artifact name {}".format(name)
+
+            if not isinstance(digest, str) or not OBJECT_RE.match(digest):
+                return "Bad object {}".format(digest)
+
+            # the object might have been corrupted since it was stored
+            if _hash_file(os.path.join(self.server.objects, digest)) != digest:
+                return "Missing or corrupted object {}".format(digest)
+
+        return None
+
+
+    def __reply(self, code, content=b''):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
@@ -5,10 +5,14 @@ import sys
 import binascii
 import os
 import contextlib
+import json
 
 from . import config
 from . import tools
 from . import glob
+from . import buildcache
+from . import connpool
+from .deployer import Deployer
 
 
 class Error(Exception):
@@ -26,7 +30,51 @@ def _setup_logging(args):
     logging.basicConfig(format='%(levelname)s: %(message)s', level=level)
 
 
-def _parse_args(args):
+def _parse_limit(arg):
+    try:
+        resource, limit = arg.split("=")
+        limit = int(limit)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected RESOURCE=N, got {}".format(arg))
+
+    if limit < 1:
+        raise argparse.ArgumentTypeError("limit of {} must be positive".format(resource))
+
+    return resource, limit
+
+
+def _parse_size(arg):
+    try:
+        return buildcache.parse_size(arg)
+    except buildcache.Error as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _parse_connections(arg):
+    try:
+        connections = int(arg)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a number of connections, got {}".format(arg))
+
+    if connections < 1:
+        raise argparse.ArgumentTypeError("number of connections must be positive")
+
+    return connections
+
+
+def _parse_threshold(arg):
+    try:
+        threshold = float(arg)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a number of seconds, got {}".format(arg))
+
+    if threshold <= 0:
+        raise argparse.ArgumentTypeError("threshold must be positive")
+
+    return threshold
+
+
+def parse_args(args):
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
@@ -37,6 +85,63 @@ def _parse_args(args):
         '--debug',
         help='Debug output',
         action='store_true')
+    parser.add_argument(
+        '--cache',
+        help='Cache the validated configuration next to the deployment descriptor, to speed up subsequent commands',
+        action='store_true')
+    parser.add_argument(
+        '--limit',
+        help='Maximum number of concurrent tasks using a resource, as RESOURCE=N. ' \
+             'Resources: build (build jobs, shared with cargo through a jobserver), attester (attester processes), ' \
+             'node (commands to each node), node:<name> (commands to a specific node). ' \
+             'Can be repeated, and overrides the "concurrency" section of the deployment descriptor',
+        dest='limits',
+        type=_parse_limit,
+        action='append',
+        default=[])
+    parser.add_argument(
+        '--build-cache',
+        help='Reuse the build artifacts of modules whose sources, flags and toolchain did not change, ' \
+             'storing them in the given directory (default: {})'.format(buildcache.default_dir()),
+        nargs='?',
+        const=buildcache.default_dir(),
+        default=None)
+    parser.add_argument(
+        '--build-cache-size',
+        help='Maximum size of the build cache, e.g., 512M or 2G. ' \
+             'Least recently used artifacts are evicted when exceeded (default: 1G)',
+        type=_parse_size,
+        default=buildcache.DEFAULT_SIZE)
+    parser.add_argument(
+        '--build-cache-remote',
+        help='URL of a remote build cache (e.g., started with "cache-server"), looked up when an artifact is not ' \
+             'in the local build cache, and updated after each build. Implies --build-cache',
+        default=None)
+    parser.add_argument(
+        '--shared-target',
+        help='Build all the Rust modules with the same target triple and build mode in a shared Cargo target directory, ' \
+             'so that common dependencies are compiled only once. Builds sharing a directory run one at a time, ' \
+             'which can be slower if modules have few dependencies in common',
+        action='store_true')
+    parser.add_argument(
+        '--persistent-connections',
+        help='Keep the connections to the event managers open, and reuse them for all the commands, ' \
+             'with at most N connections to each event manager (e.g., {}). ' \
+             'The event managers must accept multiple commands on the same connection'.format(
+                connpool.DEFAULT_MAX_CONNECTIONS),
+        metavar='N',
+        type=_parse_connections,
+        default=None)
+    parser.add_argument(
+        '--loop-lag-threshold',
+        help='Warn whenever the event loop is blocked for longer than the given number of seconds, ' \
+             'e.g., 0.1. With --verbose, a summary is reported at the end',
+        type=_parse_threshold,
+        default=None)
+    parser.add_argument(
+        '--journal',
+        help='Append state changes to a journal next to the deployment descriptor, instead of rewriting it (see the "compact" command)',
+        action='store_true')
 
     subparsers = parser.add_subparsers(dest='command')
     # Workaround a Python bug. See http://bugs.python.org/issue9253#msg186387
@@ -66,9 +171,13 @@ def _parse_args(args):
         '--deploy-in-order',
         help='Deploy modules in the order they are found in the config file',
         action='store_true')
+    deploy_parser.add_argument(
+        '--waves',
+        help='Deploy modules with the same priority concurrently, one priority level after the other',
+        action='store_true')
     deploy_parser.add_argument(
         '--output',
-        help='Output file type, between JSON and YAML',
+        help='Output file type, between JSON, YAML and MSGPACK',
         default=None)
     deploy_parser.add_argument(
         '--module',
@@ -97,6 +206,43 @@ def _parse_args(args):
         help='Module to build (if not specified, build all modules)',
         default=None)
 
+    # up
+    up_parser = subparsers.add_parser(
+        'up',
+        help='Build, deploy, attest, connect and register events in a single pipeline')
+    up_parser.set_defaults(command_handler=_handle_up)
+    up_parser.add_argument(
+        '--mode',
+        help='build mode of modules. between "debug" and "release"',
+        default='debug'
+    )
+    up_parser.add_argument(
+        'config',
+        help='Name of the configuration file describing the network')
+    up_parser.add_argument(
+        '--workspace',
+        help='Root directory containing all the modules and the configuration file',
+        default=".")
+    up_parser.add_argument(
+        '--result',
+        help='File to write the resulting configuration to')
+    up_parser.add_argument(
+        '--deploy-in-order',
+        help='Deploy modules in the order they are found in the config file',
+        action='store_true')
+    up_parser.add_argument(
+        '--waves',
+        help='Deploy modules with the same priority concurrently, one priority level after the other',
+        action='store_true')
+    up_parser.add_argument(
+        '--output',
+        help='Output file type, between JSON, YAML and MSGPACK',
+        default=None)
+    up_parser.add_argument(
+        '--plan',
+        help='Only print the tasks to run, with their dependencies and resources',
+        action='store_true')
+
     # attest
     attest_parser = subparsers.add_parser(
         'attest',
@@ -110,7 +256,7 @@ def _parse_args(args):
         help='File to write the resulting configuration to')
     attest_parser.add_argument(
         '--output',
-        help='Output file type, between JSON and YAML',
+        help='Output file type, between JSON, YAML and MSGPACK',
         default=None)
     attest_parser.add_argument(
         '--module',
@@ -130,7 +276,7 @@ def _parse_args(args):
         help='File to write the resulting configuration to')
     connect_parser.add_argument(
         '--output',
-        help='Output file type, between JSON and YAML',
+        help='Output file type, between JSON, YAML and MSGPACK',
         default=None)
     connect_parser.add_argument(
         '--connection',
@@ -150,7 +296,7 @@ def _parse_args(args):
         help='File to write the resulting configuration to')
     register_parser.add_argument(
         '--output',
-        help='Output file type, between JSON and YAML',
+        help='Output file type, between JSON, YAML and MSGPACK',
         default=None)
     register_parser.add_argument(
         '--event',
@@ -165,19 +311,34 @@ def _parse_args(args):
     call_parser.add_argument(
         'config',
         help='Specify configuration file to use')
+    call_parser.add_argument(
+        '--socket',
+        help='Send the command to a server started with "serve", listening on this UNIX socket',
+        default=None)
     call_parser.add_argument(
         '--module',
-        help='Name of the module to call',
-        required=True)
+        help='Name of the module to call (required unless --batch is used)',
+        default=None)
     call_parser.add_argument(
         '--entry',
-        help='Name of the module\'s entry point to call',
-        required=True)
+        help='Name of the module\'s entry point to call (required unless --batch is used)',
+        default=None)
     call_parser.add_argument(
         '--arg',
         help='Argument to pass to the entry point (hex byte array)',
         type=binascii.unhexlify,
         default=None)
+    call_parser.add_argument(
+        '--batch',
+        help='File containing the calls to make, one JSON object per line ' \
+             '({"module": ..., "entry": ..., "arg": ...}), or - for stdin. ' \
+             'Results are written to stdout as JSON lines',
+        default=None)
+    call_parser.add_argument(
+        '--concurrency',
+        help='Maximum number of concurrent calls in batch mode',
+        type=int,
+        default=64)
 
     # output
     output_parser = subparsers.add_parser(
@@ -187,6 +348,10 @@ def _parse_args(args):
     output_parser.add_argument(
         'config',
         help='Specify configuration file to use')
+    output_parser.add_argument(
+        '--socket',
+        help='Send the command to a server started with "serve", listening on this UNIX socket',
+        default=None)
     output_parser.add_argument(
         '--connection',
         help='Connection ID or name of the connection',
@@ -208,6 +373,10 @@ def _parse_args(args):
     request_parser.add_argument(
         'config',
         help='Specify configuration file to use')
+    request_parser.add_argument(
+        '--socket',
+        help='Send the command to a server started with "serve", listening on this UNIX socket',
+        default=None)
     request_parser.add_argument(
         '--connection',
         help='Connection ID or name of the connection',
@@ -221,80 +390,224 @@ def _parse_args(args):
         '--result',
         help='File to write the resulting configuration to')
 
-    return parser.parse_args(args)
+    # stream
+    stream_parser = subparsers.add_parser(
+        'stream',
+        help='Send a sequence of outputs or requests through a \"direct\" connection')
+    stream_parser.set_defaults(command_handler=_handle_stream)
+    stream_parser.add_argument(
+        'config',
+        help='Specify configuration file to use')
+    stream_parser.add_argument(
+        '--connection',
+        help='Connection ID or name of the connection',
+        required=True)
+    stream_parser.add_argument(
+        '--input',
+        help='File containing the payloads (hex byte arrays), one per line, or - for stdin',
+        default='-')
+    stream_parser.add_argument(
+        '--rate',
+        help='Maximum number of events per second (default: no limit)',
+        type=float,
+        default=None)
+    stream_parser.add_argument(
+        '--window',
+        help='Maximum number of events encrypted ahead of the one being sent',
+        type=int,
+        default=32)
+    stream_parser.add_argument(
+        '--result',
+        help='File to write the resulting configuration to')
 
+    # serve
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help='Keep a deployed application loaded, accepting call/output/request commands over a UNIX socket')
+    serve_parser.set_defaults(command_handler=_handle_serve)
+    serve_parser.add_argument(
+        'config',
+        help='Specify configuration file to use')
+    serve_parser.add_argument(
+        '--socket',
+        help='Path of the UNIX socket (default: <config>.sock)',
+        default=None)
+    serve_parser.add_argument(
+        '--flush-interval',
+        help='Interval (in seconds) between two writes of the state changes to the journal',
+        type=float,
+        default=1.0)
+
+    # compact
+    compact_parser = subparsers.add_parser(
+        'compact',
+        help='Merge the journal of a deployment descriptor into a new descriptor')
+    compact_parser.set_defaults(command_handler=_handle_compact)
+    compact_parser.add_argument(
+        'config',
+        help='Specify configuration file to use')
+    compact_parser.add_argument(
+        '--result',
+        help='File to write the resulting configuration to')
+    compact_parser.add_argument(
+        '--output',
+        help='Output file type, between JSON, YAML and MSGPACK',
+        default=None)
 
-def _handle_deploy(args):
-    logging.info('Deploying %s', args.config)
+    # cache-server
+    cache_server_parser = subparsers.add_parser(
+        'cache-server',
+        help='Run a remote build cache server (see --build-cache-remote), storing the artifacts in a directory')
+    cache_server_parser.set_defaults(command_handler=_handle_cache_server)
+    cache_server_parser.add_argument(
+        'directory',
+        help='Directory where the artifacts are stored')
+    cache_server_parser.add_argument(
+        '--host',
+        help='Address to listen on. The server has no authentication: only bind it to a trusted network',
+        default='localhost')
+    cache_server_parser.add_argument(
+        '--port',
+        help='Port to listen on',
+        type=int,
+        default=8100)
+
+    args = parser.parse_args(args)
+    args.limits = dict(args.limits)
+    return args
+
+
+def _write_result(conf, args, entities):
+    out_file = args.result or args.config
 
-    glob.set_build_mode(args.mode)
+    # The journal can only be used when updating the input file in place
+    if args.journal and conf.output_type == conf.input_type and \
+            os.path.abspath(out_file) == os.path.abspath(args.config):
+        logging.info('Journaling changes of %s', out_file)
+        config.journal_config(conf, entities)
+    else:
+        logging.info('Writing post-deployment configuration to %s', out_file)
+        config.dump_config(conf, out_file)
 
-    os.chdir(args.workspace)
-    conf = config.load(args.config, args.output)
 
-    conf.deploy(args.deploy_in_order, args.module)
+def _handle_deploy(args):
+    logging.info('Deploying %s', args.config)
+
+    deployer = _get_deployer(args, args.output)
+    loop = asyncio.get_event_loop()
 
-    out_file = args.result or args.config
-    logging.info('Writing post-deployment configuration to %s', out_file)
-    config.dump_config(conf, out_file)
-    conf.cleanup()
+    loop.run_until_complete(
+                    deployer.deploy(args.deploy_in_order, args.module, args.waves))
+    loop.run_until_complete(deployer.dump(args.result))
+    loop.run_until_complete(deployer.cleanup())
 
 
 def _handle_build(args):
     logging.info('Building %s', args.config)
 
-    glob.set_build_mode(args.mode)
+    deployer = _get_deployer(args)
+    loop = asyncio.get_event_loop()
 
-    os.chdir(args.workspace)
-    conf = config.load(args.config)
+    loop.run_until_complete(deployer.build(args.module))
+    loop.run_until_complete(deployer.cleanup())
+
+
+def _handle_up(args):
+    logging.info('Bringing up %s', args.config)
+
+    deployer = _get_deployer(args, args.output)
+    loop = asyncio.get_event_loop()
+
+    if args.plan:
+        print(deployer.plan(args.deploy_in_order, args.waves))
+        return
+
+    loop.run_until_complete(
+                deployer.up(args.deploy_in_order, args.result, args.waves))
+    loop.run_until_complete(deployer.cleanup())
 
-    conf.build(args.module)
-    conf.cleanup()
+
+# The build directory is always <current directory>/build, as in the previous
+# versions, where the workspace was only used as the current directory
+def _get_deployer(args, output_type=None):
+    return Deployer(args.config, args.workspace, glob.get_build_dir(),
+                    args.mode, output_type, args.cache, args.limits,
+                    args.build_cache, args.build_cache_size,
+                    args.build_cache_remote, args.shared_target,
+                    args.persistent_connections)
 
 
 def _handle_attest(args):
     logging.info('Attesting modules')
 
-    conf = config.load(args.config, args.output)
+    conf = config.load(args.config, args.output, cache=args.cache,
+                       limits=args.limits)
 
     conf.attest(args.module)
 
-    out_file = args.result or args.config
-    logging.info('Writing post-deployment configuration to %s', out_file)
-    config.dump_config(conf, out_file)
+    modules = [conf.get_module(args.module)] if args.module else conf.modules
+    _write_result(conf, args, modules)
     conf.cleanup()
 
 
 def _handle_connect(args):
     logging.info('Connecting modules')
 
-    conf = config.load(args.config, args.output)
+    conf = config.load(args.config, args.output, cache=args.cache,
+                       limits=args.limits)
 
     conf.connect(args.connection)
 
-    out_file = args.result or args.config
-    logging.info('Writing post-deployment configuration to %s', out_file)
-    config.dump_config(conf, out_file)
+    # setting keys also updates the nonces of the modules involved
+    conns = [conf.get_connection_by_name(args.connection)] if args.connection \
+                else conf.connections
+    modules = {m for c in conns for m in (c.from_module, c.to_module) if m}
+    _write_result(conf, args, conns + [m for m in conf.modules if m in modules])
     conf.cleanup()
 
 
 def _handle_register(args):
     logging.info('Registering periodic events')
 
-    conf = config.load(args.config, args.output)
+    conf = config.load(args.config, args.output, cache=args.cache,
+                       limits=args.limits)
 
     conf.register_event(args.event)
 
-    out_file = args.result or args.config
-    logging.info('Writing post-deployment configuration to %s', out_file)
-    config.dump_config(conf, out_file)
+    events = [conf.get_periodic_event(args.event)] if args.event \
+                else conf.periodic_events
+    _write_result(conf, args, events)
     conf.cleanup()
 
 
+def _send_to_server(args, request):
+    from . import server
+
+    request["arg"] = server.dump_arg(args.arg)
+    response = server.send_request(args.socket, request)
+
+    if response is not None:
+        logging.info("Response: \"{}\"".format(
+            binascii.hexlify(response).decode('ascii')))
+
+
 def _handle_call(args):
+    if args.batch:
+        _handle_call_batch(args)
+        return
+
+    if args.module is None or args.entry is None:
+        raise Error("--module and --entry are required unless --batch is used")
+
     logging.info('Calling %s:%s', args.module, args.entry)
 
-    conf = config.load(args.config)
+    if args.socket:
+        _send_to_server(args,
+            {"command": "call", "module": args.module, "entry": args.entry})
+        return
+
+    conf = config.load(args.config, cache=args.cache,
+                       limits=args.limits)
     module = conf.get_module(args.module)
 
     asyncio.get_event_loop().run_until_complete(
@@ -303,15 +616,43 @@ def _handle_call(args):
     conf.cleanup()
 
 
+def _handle_call_batch(args):
+    from . import batch
+
+    if args.socket:
+        raise Error("--batch cannot be used with --socket")
+
+    if args.batch == '-':
+        records = batch.read_records(sys.stdin)
+    else:
+        with open(args.batch, 'r') as f:
+            records = batch.read_records(f)
+
+    logging.info('Executing %d calls', len(records))
+
+    conf = config.load(args.config, cache=args.cache,
+                       limits=args.limits)
+
+    failed = asyncio.get_event_loop().run_until_complete(
+            batch.call_batch(conf, records, sys.stdout, args.concurrency))
+
+    conf.cleanup()
+
+    if failed > 0:
+        raise Error("{} of {} calls failed".format(failed, len(records)))
+
+
 def _handle_output(args):
     logging.info('Triggering output of connection %s', args.connection)
 
-    conf = config.load(args.config)
+    if args.socket:
+        _send_to_server(args, {"command": "output", "connection": args.connection})
+        return
 
-    if args.connection.isnumeric():
-        conn = conf.get_connection_by_id(int(args.connection))
-    else:
-        conn = conf.get_connection_by_name(args.connection)
+    conf = config.load(args.config, cache=args.cache,
+                       limits=args.limits)
+
+    conn = conf.get_connection(args.connection)
 
 
     if not conn.direct:
@@ -324,20 +665,21 @@ def _handle_output(args):
                                     conn.to_module.node.output(conn, args.arg))
 
     conn.nonce += 1
-    out_file = args.result or args.config
-    config.dump_config(conf, out_file)
+    _write_result(conf, args, [conn])
     conf.cleanup()
 
 
 def _handle_request(args):
     logging.info('Triggering request of connection %s', args.connection)
 
-    conf = config.load(args.config)
+    if args.socket:
+        _send_to_server(args, {"command": "request", "connection": args.connection})
+        return
 
-    if args.connection.isnumeric():
-        conn = conf.get_connection_by_id(int(args.connection))
-    else:
-        conn = conf.get_connection_by_name(args.connection)
+    conf = config.load(args.config, cache=args.cache,
+                       limits=args.limits)
+
+    conn = conf.get_connection(args.connection)
 
 
     if not conn.direct:
@@ -350,24 +692,108 @@ def _handle_request(args):
                                     conn.to_module.node.request(conn, args.arg))
 
     conn.nonce += 2
+    _write_result(conf, args, [conn])
+    conf.cleanup()
+
+
+def _handle_stream(args):
+    from . import stream
+
+    logging.info('Streaming on connection %s', args.connection)
+
+    conf = config.load(args.config, cache=args.cache,
+                       limits=args.limits)
+    conn = conf.get_connection(args.connection)
+    nonce = conn.nonce
+
+    # responses to requests are written to stdout as JSON lines
+    def on_response(index, response):
+        sys.stdout.write(json.dumps({"index": index,
+                "response": binascii.hexlify(response).decode('ascii')}) + "\n")
+
+    f = sys.stdin if args.input == '-' else open(args.input, 'r')
+
+    try:
+        stats = asyncio.get_event_loop().run_until_complete(
+                    stream.stream(conn, stream.read_payloads(f), args.rate,
+                                  args.window, on_response))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+        # the nonces used so far are persisted even if the stream failed
+        if conn.nonce != nonce:
+            _write_result(conf, args, [conn])
+
+    sys.stdout.write(json.dumps({"stats": stats.to_dict()}) + "\n")
+    conf.cleanup()
+
+
+def _handle_serve(args):
+    from . import server
+
+    conf = config.load(args.config, cache=args.cache,
+                       limits=args.limits)
+
+    socket_path = args.socket or server.get_default_socket(args.config)
+    srv = server.Server(conf, socket_path, args.flush_interval)
+
+    asyncio.get_event_loop().run_until_complete(srv.serve())
+    conf.cleanup()
+
+
+def _handle_compact(args):
+    logging.info('Compacting %s', args.config)
+
+    conf = config.load(args.config, args.output, cache=args.cache,
+                       limits=args.limits)
+
     out_file = args.result or args.config
+    logging.info('Writing configuration to %s', out_file)
     config.dump_config(conf, out_file)
     conf.cleanup()
 
 
+def _handle_cache_server(args):
+    from . import cacheserver
+
+    srv = cacheserver.CacheServer(args.directory, args.host, args.port)
+    logging.info('Serving the build cache in %s on %s:%d',
+                 args.directory, args.host, args.port)
+
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+
+
 def main(raw_args=None):
-    args = _parse_args(raw_args)
+    args = parse_args(raw_args)
     _setup_logging(args)
 
     # create working directory
     try:
-        os.mkdir(glob.BUILD_DIR)
+        os.mkdir(glob.get_build_dir())
     except FileExistsError:
         pass
     except:
         logging.error("Failed to create build dir")
         sys.exit(-1)
 
+    # commands not using a Deployer (e.g., call) run in this context
+    if args.persistent_connections is not None:
+        glob.set_connection_pool(
+                connpool.ConnectionPool(args.persistent_connections))
+
+    monitor = None
+    if args.loop_lag_threshold is not None:
+        from . import looplag
+
+        monitor = looplag.LoopLagMonitor(args.loop_lag_threshold)
+        monitor.start(asyncio.get_event_loop())
+
     try:
         args.command_handler(args)
     except Exception as e:
@@ -376,7 +802,11 @@ def main(raw_args=None):
 
         logging.error(e)
 
-        for task in asyncio.Task.all_tasks():
+        for task in asyncio.all_tasks(asyncio.get_event_loop()):
             task.cancel()
 
         sys.exit(-1)
+    finally:
+        if monitor is not None:
+            asyncio.get_event_loop().run_until_complete(monitor.stop())
+            looplag.log_stats(monitor)
@@ -0,0 +1,134 @@
+import asyncio
+import binascii
+import concurrent.futures
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from . import buildcache
+from . import glob
+from . import tools
+
+# Code generation of Rust modules with rust-sgx-gen
+#
+# rust-sgx-gen is synchronous, therefore it runs in a pool of worker processes:
+# it does not block the event loop, and several modules are generated in
+# parallel.
+#
+# Its results (the generated crate and the data of the module) are cached in
+# `<build dir>/codegen`, keyed by a hash of its inputs: the source folder, the
+# module ID, the EM port, the runner and the SP public key. Native modules
+# generated from the cache get the same module key.
+
+CACHE_DIR = "codegen"
+RESULT_FILE = "result.json"
+TREE_DIR = "tree"
+
+__pool = None
+
+
+class Error(Exception):
+    pass
+
+
+# Workers are spawned instead of forked, since the event loop (and its threads)
+# must not be copied into them
+def _get_pool():
+    global __pool
+
+    if __pool is None:
+        __pool = concurrent.futures.ProcessPoolExecutor(
+                        mp_context=multiprocessing.get_context("spawn"))
+
+    return __pool
+
+
+async def import_generator():
+    """
+    Imports and returns the rustsgxgen module. Importing it takes a while,
+    therefore it is done in the pool of blocking work (see tools.run_blocking)
+    """
+    return await tools.run_blocking(importlib.import_module, "rustsgxgen")
+
+
+def _generate(args):
+    import rustsgxgen
+    return rustsgxgen.generate(args)
+
+
+async def generate(args):
+    """
+    Runs rustsgxgen.generate(args), or copies the cached result to
+    `args.output`. Returns the same as rustsgxgen.generate: (data, key)
+    """
+    key = await buildcache.make_key("codegen", {
+            "codegen": buildcache.package_version("rust-sgx-gen"),
+            "id": args.moduleid,
+            "emport": args.emport,
+            "runner": str(args.runner)
+        }, files=[args.spkey] if args.spkey else [], trees=[args.input])
+
+    entry = os.path.join(glob.get_build_dir(), CACHE_DIR, key)
+    result = await tools.run_blocking(_fetch, entry, args.output)
+    if result is not None:
+        logging.debug("Using cached code of {}".format(args.output))
+        return result
+
+    loop = asyncio.get_event_loop()
+    data, module_key = await loop.run_in_executor(_get_pool(), _generate, args)
+    await tools.run_blocking(_store, entry, args.output, data, module_key)
+
+    return data, module_key
+
+
+def _fetch(entry, output):
+    try:
+        with open(os.path.join(entry, RESULT_FILE), 'r') as f:
+            result = json.load(f)
+
+        _copy_tree(os.path.join(entry, TREE_DIR), output)
+    except FileNotFoundError:
+        return None
+
+    key = result["key"]
+    return result["data"], None if key is None else binascii.unhexlify(key)
+
+
+# Files get a new modification time, otherwise cargo could consider an old
+# build of a different module in `dst` up to date
+def _copy_tree(src, dst):
+    for dirpath, _, filenames in os.walk(src):
+        d = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(d, exist_ok=True)
+
+        for name in filenames:
+            shutil.copy(os.path.join(dirpath, name), os.path.join(d, name))
+
+
+# The entry is written to a temporary directory and renamed, so that concurrent
+# builds of the same module never see an incomplete entry
+def _store(entry, output, data, key):
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(entry))
+
+    try:
+        shutil.copytree(output, os.path.join(tmp, TREE_DIR),
+                        ignore=shutil.ignore_patterns("target"))
+
+        with open(os.path.join(tmp, RESULT_FILE), 'w') as f:
+            json.dump({
+                "data": data,
+                "key": None if key is None else
+                            binascii.hexlify(key).decode('ascii')
+            }, f)
+
+        os.rename(tmp, entry)
+    except OSError as e:
+        if not os.path.exists(entry):
+            logging.warning("Failed to cache the code of {}: {}".format(
+                                output, e))
+        shutil.rmtree(tmp, ignore_errors=True)
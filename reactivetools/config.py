@@ -3,20 +3,26 @@ import ipaddress
 import os
 import asyncio
 import logging
+import hashlib
+import itertools
 
 from .modules import Module
 from .nodes import Node
 from .connection import Connection
 from .crypto import Encryption
 from .periodic_event import PeriodicEvent
+from .scheduler import Scheduler, default_limits, get_limit, node_resource
 from . import tools
+from . import journal
+from . import glob
 from .dumpers import *
 from .loaders import *
 from .rules.evaluators import *
 from .descriptor import DescriptorType
+from . import __version__
 
-from .nodes import node_rules, node_funcs, node_cleanup_coros
-from .modules import module_rules, module_funcs, module_cleanup_coros
+from .nodes import node_rules, get_node_class, get_node_cleanup_coros
+from .modules import module_rules, get_module_class, get_module_cleanup_coros
 
 
 class Error(Exception):
@@ -28,58 +34,117 @@ class Config:
         self.nodes = []
         self.modules = []
         self.connections = []
+        self.periodic_events = []
         self.connections_id = 0
         self.output_type = None
+        self.input_type = None
+        self.file_name = None
+        self.file_hash = None
 
-    def get_node(self, name):
-        for n in self.nodes:
-            if n.name == name:
-                return n
+        # concurrency limits given in the descriptor, and the ones actually
+        # used, which also include the defaults and the overrides (see
+        # scheduler.py)
+        self.concurrency = {}
+        self.limits = default_limits()
 
-        raise Error('No node with name {}'.format(name))
+        # indexes, kept consistent by the add_* methods below
+        self.__nodes_by_name = {}
+        self.__modules_by_name = {}
+        self.__connections_by_id = {}
+        self.__connections_by_name = {}
+        self.__events_by_name = {}
+        # entity -> (section of the descriptor, index in the section)
+        self.__positions = {}
 
-    def get_module(self, name):
-        for m in self.modules:
-            if m.name == name:
-                return m
 
-        raise Error('No module with name {}'.format(name))
+    def add_node(self, node):
+        _add_to_index(self.__nodes_by_name, node.name, node, 'node name')
+        self.__positions[node] = ('nodes', len(self.nodes))
+        self.nodes.append(node)
 
 
-    def get_connection_by_id(self, id):
-        for c in self.connections:
-            if c.id == id:
-                return c
+    def add_module(self, module):
+        _add_to_index(self.__modules_by_name, module.name, module, 'module name')
+        self.__positions[module] = ('modules', len(self.modules))
+        self.modules.append(module)
 
-        raise Error('No connection with ID {}'.format(id))
 
+    def add_connection(self, conn):
+        if conn.id in self.__connections_by_id:
+            raise Error('Duplicate connection ID: {}'.format(conn.id))
+        if conn.name in self.__connections_by_name:
+            raise Error('Duplicate connection name: {}'.format(conn.name))
 
-    def get_connection_by_name(self, name):
-        for c in self.connections:
-            if c.name == name:
-                return c
+        self.__connections_by_id[conn.id] = conn
+        self.__connections_by_name[conn.name] = conn
+        self.__positions[conn] = ('connections', len(self.connections))
+        self.connections.append(conn)
 
-        raise Error('No connection with name {}'.format(name))
 
+    def add_periodic_event(self, event):
+        _add_to_index(self.__events_by_name, event.name, event, 'periodic event name')
+        self.__positions[event] = ('periodic-events', len(self.periodic_events))
+        self.periodic_events.append(event)
+
+
+    def set_limits(self, limits):
+        self.limits.update(limits)
+
+        for node in self.nodes:
+            node.set_concurrency(get_limit(self.limits, node_resource(node)))
+
+
+    def get_position(self, entity):
+        try:
+            return self.__positions[entity]
+        except KeyError:
+            raise Error('{} does not belong to the configuration'.format(entity.name))
+
+
+    def get_node(self, name):
+        try:
+            return self.__nodes_by_name[name]
+        except KeyError:
+            raise Error('No node with name {}'.format(name))
 
-    def get_periodic_event(self, name):
-        for e in self.periodic_events:
-            if e.name == name:
-                return e
 
-        raise Error('No periodic event with name {}'.format(name))
+    def get_module(self, name):
+        try:
+            return self.__modules_by_name[name]
+        except KeyError:
+            raise Error('No module with name {}'.format(name))
+
+
+    def get_connection_by_id(self, id):
+        try:
+            return self.__connections_by_id[id]
+        except KeyError:
+            raise Error('No connection with ID {}'.format(id))
 
 
-    async def deploy_priority_modules(self):
-        priority_modules = [sm for sm in self.modules if sm.priority is not None and not sm.deployed]
-        priority_modules.sort(key=lambda sm : sm.priority)
+    def get_connection_by_name(self, name):
+        try:
+            return self.__connections_by_name[name]
+        except KeyError:
+            raise Error('No connection with name {}'.format(name))
 
-        logging.debug("Priority modules: {}".format([sm.name for sm in priority_modules]))
-        for module in priority_modules:
-            await module.deploy()
 
+    # conn can be either the ID or the name of the connection
+    def get_connection(self, conn):
+        if isinstance(conn, int) or conn.isnumeric():
+            return self.get_connection_by_id(int(conn))
 
-    async def deploy_async(self, in_order, module):
+        return self.get_connection_by_name(conn)
+
+
+    def get_periodic_event(self, name):
+        try:
+            return self.__events_by_name[name]
+        except KeyError:
+            raise Error('No periodic event with name {}'.format(name))
+
+
+    async def deploy_async(self, in_order, module, waves=False):
         # If module is not None, deploy just this one
         if module:
             mod = self.get_module(module)
@@ -90,33 +155,26 @@ class Config:
             await mod.deploy()
             return
 
-        # First, deploy all modules that have a priority (in order of priority)
-        await self.deploy_priority_modules()
-
-        # If deployment in order is desired, deploy one module at a time
-        if in_order:
-            for module in self.modules:
-                if not module.deployed:
-                    await module.deploy()
-        # Otherwise, deploy all modules concurrently
-        else:
-            lst = self.modules
-            l_filter = lambda x : not x.deployed
-            l_map = lambda x : x.deploy()
+        # Modules with a priority are deployed first, in order of priority;
+        # then, all the others concurrently, or one at a time if in_order
+        # is True (see plan_up). Builds start right away, in order of priority
+        await self.__run_steps(self.plan_up(in_order, waves), "build", "deploy")
 
-            futures = map(l_map, filter(l_filter, lst))
-            await asyncio.gather(*futures)
 
-
-    def deploy(self, in_order, module):
-        asyncio.get_event_loop().run_until_complete(self.deploy_async(in_order, module))
+    def deploy(self, in_order, module, waves=False):
+        asyncio.get_event_loop().run_until_complete(
+                        self.deploy_async(in_order, module, waves))
 
 
     async def build_async(self, module):
         lst = self.modules if not module else [self.get_module(module)]
 
-        futures = [module.build() for module in lst]
-        await asyncio.gather(*futures)
+        scheduler = Scheduler(self.limits)
+        for m in lst:
+            scheduler.add("build:{}".format(m.name), m.build,
+                          resources=["build"], priority=m.priority)
+
+        await scheduler.run()
 
 
     def build(self, module):
@@ -133,8 +191,7 @@ class Config:
 
         logging.info("To attest: {}".format([x.name for x in to_attest]))
 
-        futures = map(lambda x : x.attest(), to_attest)
-        await asyncio.gather(*futures)
+        await self.__run_steps(self.plan_up(), "attest", entities=to_attest)
 
 
     def attest(self, module):
@@ -154,8 +211,7 @@ class Config:
 
         logging.info("To connect: {}".format([x.name for x in to_connect]))
 
-        futures = map(lambda x : x.establish(), to_connect)
-        await asyncio.gather(*futures)
+        await self.__run_steps(self.plan_up(), "connect", entities=to_connect)
 
 
     def connect(self, conn):
@@ -172,74 +228,257 @@ class Config:
 
         logging.info("To register: {}".format([x.name for x in to_register]))
 
-        futures = map(lambda x : x.register(), to_register)
-        await asyncio.gather(*futures)
+        await self.__run_steps(self.plan_up(), "register", entities=to_register)
 
 
     def register_event(self, event):
         asyncio.get_event_loop().run_until_complete(self.register_async(event))
 
 
+    # Task graph to build, deploy, attest, connect and register everything
+    # (see scheduler.py): each step of an entity starts as soon as its own
+    # dependencies are done (e.g., a connection is established as soon as both
+    # its modules are attested), instead of waiting for all the entities of
+    # the previous step
+    def plan_up(self, in_order=False, waves=False):
+        scheduler = Scheduler(self.limits)
+
+        # modules first: connections and events depend on their tasks
+        for module in self.modules:
+            module.emit_tasks(scheduler)
+
+        self.__add_deploy_order(scheduler, in_order, waves)
+
+        for conn in self.connections:
+            conn.emit_tasks(scheduler)
+
+        for event in self.periodic_events:
+            event.emit_tasks(scheduler)
+
+        return scheduler
+
+
+    # As in deploy_async: first, deploy the modules with a priority, in order
+    # of priority; then, the others (one at a time if in_order is True).
+    # Modules with a priority are deployed one at a time, or in waves if waves
+    # is True: all the modules with the same priority at once, after all the
+    # ones of the previous wave
+    def __add_deploy_order(self, scheduler, in_order, waves):
+        to_deploy = [m for m in self.modules if not m.deployed]
+        priority_modules = sorted([m for m in to_deploy if m.priority is not None],
+                                  key=lambda m: m.priority)
+        other_modules = [m for m in to_deploy if m.priority is None]
+
+        get_deploy = lambda m: scheduler.get("deploy:{}".format(m.name))
+
+        if waves:
+            groups = [list(wave) for _, wave in
+                        itertools.groupby(priority_modules, lambda m: m.priority)]
+        else:
+            groups = [[m] for m in priority_modules]
+
+        if in_order:
+            groups += [[m] for m in other_modules]
+        elif other_modules:
+            groups.append(other_modules)
+
+        previous = []
+        for group in groups:
+            deploys = [get_deploy(m) for m in group]
+
+            for deploy in deploys:
+                for dep in previous:
+                    deploy.add_dependency(dep)
+
+            previous = deploys
+
+
+    # `on_change` is called with the entities whose state has changed
+    async def up_async(self, in_order=False, on_change=lambda *entities: None,
+                       waves=False):
+        scheduler = self.plan_up(in_order, waves)
+        await scheduler.run(lambda task: on_change(*task.entities))
+
+
+    # Run only the tasks of some steps (e.g., "attest"), optionally only those
+    # of some entities
+    async def __run_steps(self, scheduler, *steps, entities=None):
+        names = None if entities is None else {e.name for e in entities}
+
+        def selected(task):
+            step, name = task.name.split(":", 1)
+            return step in steps and (names is None or name in names)
+
+        await scheduler.select(selected).run()
+
+
     async def cleanup_async(self):
-        coros = list(map(lambda c: c(), node_cleanup_coros + module_cleanup_coros))
+        coros = list(map(lambda c: c(),
+                    get_node_cleanup_coros() + get_module_cleanup_coros()))
         await asyncio.gather(*coros)
 
+        pool = glob.get_connection_pool()
+        if pool is not None:
+            from . import connpool
+
+            await pool.close()
+            connpool.log_stats(pool)
+
 
     def cleanup(self):
         asyncio.get_event_loop().run_until_complete(self.cleanup_async())
 
 
-def load(file_name, output_type=None):
+def load(file_name, output_type=None, cache=False, limits=None):
     config = Config()
     desc_type = DescriptorType.from_str(output_type)
 
-    contents, input_type = DescriptorType.load_any(file_name)
+    data = DescriptorType.read(file_name)
+    digest = hashlib.sha256(data).hexdigest()
+
+    if cache:
+        contents, input_type = _load_cached(file_name, data, digest)
+    else:
+        contents, input_type = DescriptorType.loads_any(data)
+        validate(contents)
+
+    # Fold in the state changes journaled since the descriptor was written
+    _apply_journal(contents, journal.read(file_name, digest))
+
+    config.file_name = file_name
+    config.file_hash = digest
+    config.input_type = input_type
 
     # Output file format is:
     #   - desc_type if has been provided as input, or
     #   - the same type of the input file otherwise
     config.output_type = desc_type or input_type
 
-    config.nodes = load_list(contents['nodes'],
-                                lambda n: _load_node(n, config))
-    config.modules = load_list(contents['modules'],
-                                lambda m: _load_module(m, config))
+    for node_dict in load_list(contents['nodes']):
+        config.add_node(_load_node(node_dict, config))
+
+    for mod_dict in load_list(contents['modules']):
+        config.add_module(_load_module(mod_dict, config))
 
     config.connections_current_id = contents.get('connections_current_id') or 0
     config.events_current_id = contents.get('events_current_id') or 0
 
-    if 'connections' in contents:
-        config.connections = load_list(contents['connections'],
-                                        lambda c: _load_connection(c, config))
-    else:
-        config.connections = []
+    for conn_dict in load_list(contents.get('connections')):
+        config.add_connection(_load_connection(conn_dict, config))
 
-    if 'periodic-events' in contents:
-        config.periodic_events = load_list(contents['periodic-events'],
-                                        lambda e: _load_periodic_event(e, config))
-    else:
-        config.periodic_events = []
+    for event_dict in load_list(contents.get('periodic-events')):
+        config.add_periodic_event(_load_periodic_event(event_dict, config))
+
+    # limits given as parameter override the ones in the descriptor
+    config.concurrency = _load_concurrency(contents.get('concurrency'))
+    config.set_limits({**config.concurrency, **(limits or {})})
 
     return config
 
 
-def _load_node(node_dict, config):
-    # Basic rules common to all nodes
-    evaluate_rules(os.path.join("default", "node.yaml"), node_dict)
-    # Specific rules for a specific node type
-    evaluate_rules(os.path.join("nodes", node_rules[node_dict['type']]), node_dict)
+def _load_concurrency(limits):
+    if limits is None:
+        return {}
 
-    return node_funcs[node_dict['type']](node_dict)
+    if not isinstance(limits, dict):
+        raise Error("Bad concurrency limits: expected a dict of resource -> limit")
 
+    for resource, limit in limits.items():
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            raise Error("Bad concurrency limit for {}: {}".format(resource, limit))
 
-def _load_module(mod_dict, config):
-    # Basic rules common to all nodes
-    evaluate_rules(os.path.join("default", "module.yaml"), mod_dict)
-    # Specific rules for a specific node type
-    evaluate_rules(os.path.join("modules", module_rules[mod_dict['type']]), mod_dict)
+    return dict(limits)
+
+
+# The parsed and validated contents of a descriptor are cached in a sidecar
+# file, keyed by the hash of the descriptor and the version of reactive-tools.
+# Subsequent loads of the same descriptor skip both parsing and validation,
+# and any change to the descriptor invalidates the cache.
+#
+# The cache is stored as msgpack, which (unlike pickle) cannot run code when
+# loaded: the sidecar is only as trusted as the directory it is in
+def _load_cached(file_name, data, digest):
+    key = "{}:{}".format(__version__, digest)
+    cache_file = _get_cache_file(file_name)
+
+    try:
+        cached = DescriptorType.MSGPACK.load(cache_file, strict_keys=False)
+
+        if cached['key'] == key:
+            logging.debug("Using cached configuration {}".format(cache_file))
+            return cached['contents'], DescriptorType(cached['type'])
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        # rewritten below, but a cache that can never be used is a bug
+        logging.warning("Discarding cache {}: {}".format(cache_file, e))
+
+    contents, input_type = DescriptorType.loads_any(data)
+    validate(contents)
+
+    cached = {
+        'key': key,
+        'type': int(input_type),
+        'contents': contents
+    }
+
+    # write-and-rename, so that a concurrent load never sees a partial file.
+    # The temporary file is removed on any error, e.g., if the contents
+    # cannot be serialized
+    try:
+        DescriptorType.MSGPACK.dump(cache_file, cached)
+    except Exception as e:
+        logging.warning("Failed to write cache {}".format(cache_file))
+        logging.debug(e)
+
+    return contents, input_type
+
+
+def _get_cache_file(file_name):
+    dir, name = os.path.split(os.path.abspath(file_name))
+    return os.path.join(dir, ".{}.cache".format(name))
+
+
+def _apply_journal(contents, records):
+    for record in records:
+        section = contents.get(record['section'])
+        index = record['index']
+
+        if not isinstance(section, list) or not 0 <= index < len(section) \
+                or not _same_entity(section[index], record):
+            raise Error("Journal does not match the deployment descriptor")
+
+        section[index] = record['entity']
+
+
+# A record only applies to the entity it was written for. Connections and
+# periodic events might have no name in the descriptor (a default one, based
+# on their ID, is used): their IDs are compared instead
+def _same_entity(current, record):
+    if not isinstance(current, dict):
+        return False
+
+    if current.get('name') is not None:
+        return current['name'] == record.get('name')
+
+    return current.get('id') is not None and \
+            current.get('id') == record['entity'].get('id')
+
+
+def _add_to_index(index, key, value, what):
+    if key in index:
+        raise Error('Duplicate {}: {}'.format(what, key))
+
+    index[key] = value
 
+
+def _load_node(node_dict, config):
+    return get_node_class(node_dict['type']).load(node_dict)
+
+
+def _load_module(mod_dict, config):
     node = config.get_node(mod_dict['node'])
-    module = module_funcs[mod_dict['type']](mod_dict, node)
+    module = get_module_class(mod_dict['type']).load(mod_dict, node)
 
     if node.__class__ not in module.get_supported_nodes():
         raise Error("Node {} ({}) does not support module {} ({})".format(
@@ -250,42 +489,102 @@ def _load_module(mod_dict, config):
 
 
 def _load_connection(conn_dict, config):
-    evaluate_rules(os.path.join("default", "connection.yaml"), conn_dict)
     return Connection.load(conn_dict, config)
 
 
 def _load_periodic_event(events_dict, config):
-    evaluate_rules(os.path.join("default", "periodic_event.yaml"), events_dict)
     return PeriodicEvent.load(events_dict, config)
 
 
-def evaluate_rules(rules_file, dict):
-    rules = load_rules(rules_file)
+# Check the whole deployment descriptor against the rules, before creating
+# any object. All the broken rules of all the entities are reported at once
+def validate(contents):
+    errors = []
 
-    ok = True
+    for node_dict in load_list(contents.get('nodes')):
+        # Basic rules common to all nodes
+        errors += evaluate_rules(os.path.join("default", "node.yaml"), node_dict)
+        # Specific rules for a specific node type
+        errors += _evaluate_type_rules("nodes", node_rules, node_dict)
 
-    for r in rules:
-        try:
-            result = eval(rules[r])
-        except:
-            result = False
+    for mod_dict in load_list(contents.get('modules')):
+        # Basic rules common to all modules
+        errors += evaluate_rules(os.path.join("default", "module.yaml"), mod_dict)
+        # Specific rules for a specific module type
+        errors += _evaluate_type_rules("modules", module_rules, mod_dict)
+
+    for conn_dict in load_list(contents.get('connections')):
+        errors += evaluate_rules(os.path.join("default", "connection.yaml"), conn_dict)
+
+    for event_dict in load_list(contents.get('periodic-events')):
+        errors += evaluate_rules(os.path.join("default", "periodic_event.yaml"), event_dict)
+
+    for e in errors:
+        logging.error(e)
+
+    if errors:
+        raise Error("Bad deployment descriptor: {} broken rule(s)".format(len(errors)))
+
+
+def evaluate_rules(rules_file, entity):
+    return ["{} - {} - Broken rule: {}".format(rules_file, _entity_name(entity), r)
+                for r in check_rules(rules_file, entity)]
+
+
+def _evaluate_type_rules(folder, rules, entity):
+    type = entity.get('type') if isinstance(entity, dict) else None
+
+    if type not in rules:
+        return ["{} - Unknown type: {}".format(_entity_name(entity), type)]
 
-        if not result:
-            logging.error("{} - Broken rule: {}".format(rules_file, r))
-            ok = False
+    return evaluate_rules(os.path.join(folder, rules[type]), entity)
 
-    if not ok:
-        raise Error("Bad deployment descriptor")
+
+def _entity_name(entity):
+    name = entity.get('name') if isinstance(entity, dict) else None
+    return name or "<unnamed>"
 
 
 def dump_config(config, file_name):
     config.output_type.dump(file_name, dump(config))
+    # the new descriptor already includes all the journaled changes
+    journal.remove(file_name)
+
+
+# Coroutine. Same as dump_config, but can be used inside a running event loop
+async def dump_config_async(config, file_name):
+    config.output_type.dump(file_name, await dump_async(config))
+    journal.remove(file_name)
+
+
+# Append the current state of some entities to the journal of the descriptor
+# the configuration was loaded from, instead of rewriting the whole file
+def journal_config(config, entities):
+    records = [_journal_record(config, e, dump(e)) for e in entities]
+    journal.append(config.file_name, config.file_hash, records)
+
+
+# Coroutine. Same as journal_config, but can be used inside a running event loop
+async def journal_config_async(config, entities):
+    records = [_journal_record(config, e, await dump_async(e)) for e in entities]
+    journal.append(config.file_name, config.file_hash, records)
+
+
+def _journal_record(config, entity, dumped):
+    section, index = config.get_position(entity)
+
+    return {
+        'section': section,
+        'index': index,
+        'name': entity.name,
+        'entity': dumped
+    }
 
 
 @dump.register(Config)
 def _(config):
     dump(config.nodes)
-    return {
+    data = {
             'nodes': dump(config.nodes),
             'modules': dump(config.modules),
             'connections_current_id': config.connections_current_id,
@@ -294,6 +593,11 @@ def _(config):
             'periodic-events' : dump(config.periodic_events)
         }
 
+    if config.concurrency:
+        data['concurrency'] = config.concurrency
+
+    return data
+
 
 @dump.register(Node)
 def _(node):
@@ -8,6 +8,7 @@ from .rules.evaluators import *
 
 from .crypto import Encryption
 from . import tools
+from .scheduler import node_resource
 
 class Error(Exception):
     pass
@@ -132,6 +133,21 @@ class Connection:
         self.established = True
 
 
+    # Add the task to establish the connection to a Scheduler, if needed
+    def emit_tasks(self, scheduler):
+        if self.established:
+            return
+
+        modules = [m for m in (self.from_module, self.to_module) if m]
+        attests = [scheduler.get("attest:{}".format(m.name)) for m in modules]
+
+        # setting keys also updates the nonces of the modules involved
+        scheduler.add("connect:{}".format(self.name), self.establish,
+                      deps=attests,
+                      resources=[node_resource(m.node) for m in modules],
+                      entities=[self] + modules)
+
+
     async def __establish_normal(self):
         from_node, to_node = self.from_module.node, self.to_module.node
 
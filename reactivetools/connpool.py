@@ -0,0 +1,230 @@
+import asyncio
+import collections
+import logging
+
+from reactivenet import ResultMessage
+import reactivenet
+
+# Pool of persistent connections to the event managers
+#
+# By default, each reactive command opens a new TCP connection to the event
+# manager, which is closed right after the response. With a pool, connections
+# to each event manager (i.e., IP address and port) are kept open and reused
+# by the following commands.
+#
+# The protocol has no request IDs, but the responses are sent in the same
+# order as the commands: commands are pipelined, i.e., sent on a connection
+# without waiting for the responses to the previous ones, and a reader task
+# hands the responses over to the commands in order. Commands without a
+# response (e.g., RemoteOutput) are only written.
+#
+# A command uses an idle connection if there is one, otherwise a new one is
+# opened, up to `max_connections` per event manager. Beyond that, commands are
+# pipelined on the connection with the fewest commands waiting for a response.
+#
+# Connections closed by the event manager (e.g., after a timeout) are replaced
+# by new ones. If a connection breaks while some commands are waiting for a
+# response, these commands fail: they might have been executed already, and
+# they are not idempotent (e.g., nonces), therefore they are never retried.
+#
+# NOTE: the event manager must accept multiple commands on the same connection,
+#       which is why the pool is not used by default
+
+DEFAULT_MAX_CONNECTIONS = 4
+
+
+class Error(Exception):
+    pass
+
+
+class Stats:
+    def __init__(self):
+        self.commands = 0
+        self.connections = 0
+        self.reused = 0
+        self.pipelined = 0
+        self.lost = 0
+
+
+    def __str__(self):
+        return "{} commands on {} connections ({} commands on a reused " \
+               "connection, {} pipelined), {} connections lost".format(
+                   self.commands, self.connections, self.reused,
+                   self.pipelined, self.lost)
+
+
+class _Connection:
+    def __init__(self, reader, writer, stats):
+        self.__reader = reader
+        self.__writer = writer
+        self.__stats = stats
+        # futures of the commands waiting for a response, in order
+        self.__pending = collections.deque()
+        self.__task = asyncio.ensure_future(self.__read_responses())
+
+
+    @property
+    def closed(self):
+        return self.__task.done() or self.__writer.is_closing()
+
+
+    @property
+    def in_flight(self):
+        return len(self.__pending)
+
+
+    async def send(self, command):
+        fut = None
+
+        if command.has_response():
+            fut = asyncio.get_event_loop().create_future()
+            self.__pending.append(fut)
+
+        try:
+            self.__writer.write(command.pack())
+            await self.__writer.drain()
+        except ConnectionError as e:
+            self.close(e)
+
+            if fut is None:
+                raise Error("Connection to the event manager lost: {}".format(e))
+
+        if fut is None:
+            return None
+
+        return await fut
+
+
+    def close(self, error=None):
+        if not self.closed:
+            self.__writer.close()
+
+            if error is not None:
+                self.__stats.lost += 1
+
+        if not self.__task.done() and self.__task is not asyncio.current_task():
+            self.__task.cancel()
+
+        while self.__pending:
+            fut = self.__pending.popleft()
+            if not fut.done():
+                fut.set_exception(Error("Connection to the event manager " \
+                                        "lost: {}".format(error or "closed")))
+
+
+    async def wait_closed(self):
+        try:
+            await self.__task
+        except asyncio.CancelledError:
+            pass
+
+        try:
+            await self.__writer.wait_closed()
+        except OSError:
+            pass
+
+
+    async def __read_responses(self):
+        try:
+            while True:
+                response = await ResultMessage.read(self.__reader)
+
+                if not self.__pending:
+                    raise Error("Unexpected response from the event manager")
+
+                # the command might have been cancelled in the meantime
+                fut = self.__pending.popleft()
+                if not fut.done():
+                    fut.set_result(response)
+        except asyncio.IncompleteReadError as e:
+            # closed by the event manager: this is an error only if some
+            # commands are still waiting for a response
+            self.close(e if self.__pending or e.partial else None)
+        except (ConnectionError, reactivenet.Error, Error) as e:
+            self.close(e)
+
+
+class ConnectionPool:
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS):
+        """
+        max_connections: maximum number of connections to each event manager
+        """
+        if max_connections < 1:
+            raise Error("The maximum number of connections must be positive")
+
+        self.max_connections = max_connections
+        self.stats = Stats()
+        # (ip, port) -> list of connections
+        self.__connections = {}
+        # (ip, port) -> number of connections being opened
+        self.__opening = collections.Counter()
+        # notified whenever a connection has been opened (or failed to)
+        self.__opened = asyncio.Condition()
+
+
+    async def send(self, command):
+        """
+        Sends a reactive command (reactivenet.CommandMessage) to its
+        destination, and returns its response, or None if the command has no
+        response
+        """
+        conn = await self.__get_connection(str(command.ip), command.port)
+        self.stats.commands += 1
+
+        return await conn.send(command)
+
+
+    async def close(self):
+        conns = [c for conns in self.__connections.values() for c in conns]
+        self.__connections.clear()
+
+        for conn in conns:
+            conn.close()
+
+        await asyncio.gather(*[c.wait_closed() for c in conns])
+
+
+    async def __get_connection(self, ip, port):
+        dest = (ip, port)
+        conns = self.__connections.setdefault(dest, [])
+
+        while True:
+            conns[:] = [c for c in conns if not c.closed]
+
+            conn = min(conns, key=lambda c: c.in_flight, default=None)
+            can_open = len(conns) + self.__opening[dest] < self.max_connections
+
+            if conn is not None and (conn.in_flight == 0 or not can_open):
+                self.stats.reused += 1
+                self.stats.pipelined += conn.in_flight > 0
+                return conn
+
+            if can_open:
+                return await self.__open(dest, conns)
+
+            # all the connections are being opened
+            async with self.__opened:
+                await self.__opened.wait()
+
+
+    async def __open(self, dest, conns):
+        self.__opening[dest] += 1
+        try:
+            reader, writer = await asyncio.open_connection(*dest)
+        finally:
+            self.__opening[dest] -= 1
+            async with self.__opened:
+                self.__opened.notify_all()
+
+        logging.debug("New connection to the event manager at {}:{}".format(
+                        *dest))
+
+        conn = _Connection(reader, writer, self.stats)
+        conns.append(conn)
+        self.stats.connections += 1
+        return conn
+
+
+def log_stats(pool):
+    if pool is not None and pool.stats.commands > 0:
+        logging.info("Connection pool: {}".format(pool.stats))
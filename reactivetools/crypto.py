@@ -1,11 +1,16 @@
 import base64
 import asyncio
 from enum import IntEnum
-from Crypto.Cipher import AES
 
 from . import tools
 from . import glob
 
+# AES-GCM is implemented in C by pycryptodome: small payloads are encrypted on
+# the event loop, since handing them over to a thread would cost more than
+# encrypting them. Larger ones, and all SPONGENT payloads (implemented in
+# Python by the Sancus libraries), go to the pool of blocking work
+AES_BLOCKING_SIZE = 1 << 16
+
 class Error(Exception):
     pass
 
@@ -56,6 +61,15 @@ class Encryption(IntEnum):
 
 
 async def encrypt_aes(key, ad, data=[]):
+    if len(ad) + len(data) > AES_BLOCKING_SIZE:
+        return await tools.run_blocking(_encrypt_aes, key, ad, data)
+
+    return _encrypt_aes(key, ad, data)
+
+
+def _encrypt_aes(key, ad, data):
+    from Crypto.Cipher import AES
+
     # Note: we set nonce to zero because our nonce is part of the associated data
     aes_gcm = AES.new(key, AES.MODE_GCM, nonce=b'\x00'*12)
     aes_gcm.update(ad)
@@ -65,6 +79,15 @@ async def encrypt_aes(key, ad, data=[]):
 
 
 async def decrypt_aes(key, ad, data=[]):
+    if len(ad) + len(data) > AES_BLOCKING_SIZE:
+        return await tools.run_blocking(_decrypt_aes, key, ad, data)
+
+    return _decrypt_aes(key, ad, data)
+
+
+def _decrypt_aes(key, ad, data):
+    from Crypto.Cipher import AES
+
     try:
         aes_gcm = AES.new(key, AES.MODE_GCM, nonce=b'\x00'*12)
         aes_gcm.update(ad)
@@ -82,7 +105,7 @@ async def encrypt_spongent(key, ad, data=[]):
     except:
         raise Error("Sancus python libraries not found in PYTHONPATH")
 
-    cipher, tag = sancus.crypto.wrap(key, ad, data)
+    cipher, tag = await tools.run_blocking(sancus.crypto.wrap, key, ad, data)
     return cipher + tag
 
 
@@ -98,7 +121,8 @@ async def decrypt_spongent(key, ad, data=[]):
     cipher = data[:-tag_size]
     tag = data[-tag_size:]
 
-    plain = sancus.crypto.unwrap(key, ad, cipher, tag)
+    plain = await tools.run_blocking(sancus.crypto.unwrap, key, ad, cipher,
+                                     tag)
 
     if plain is None:
         raise Error("Decryption failed")
@@ -0,0 +1,202 @@
+import asyncio
+import contextvars
+import logging
+import os
+
+from . import buildcache
+from . import config
+from . import glob
+from . import journal
+from . import jobserver
+
+# A Deployer drives the deployment of an application from Python code.
+#
+# Each Deployer owns its workspace, build directory, build mode and Config,
+# and does not change the state of the process (e.g., the current directory):
+# many deployments can run concurrently in the same event loop.
+#
+# Example:
+#   deployer = Deployer("descriptor.json", workspace="app", build_mode="release")
+#   await deployer.deploy()
+#   await deployer.attest()
+#   await deployer.connect()
+#   await deployer.dump("result.json")
+#
+# or, to do everything in a single pipeline:
+#   await deployer.up(result="result.json")
+#   await deployer.cleanup()
+
+
+class Error(Exception):
+    pass
+
+
+class Deployer:
+    def __init__(self, config_file, workspace=".", build_dir=None,
+                 build_mode="debug", output_type=None, cache=False,
+                 limits=None, build_cache=None,
+                 build_cache_size=buildcache.DEFAULT_SIZE,
+                 build_cache_remote=None, shared_target=False,
+                 persistent_connections=None):
+        """
+        config_file: deployment descriptor, relative to the workspace
+        workspace: root directory of the application. Relative paths in the
+                   deployment descriptor are resolved against it
+        build_dir: directory of the build artifacts (default: <workspace>/build)
+        build_mode: "debug" or "release"
+        output_type: format of the output descriptor (default: same as input)
+        limits: concurrency limits, overriding the ones of the descriptor
+                (see scheduler.py)
+        build_cache: directory of the cache of build artifacts, which can be
+                     shared with other deployments (default: no cache)
+        build_cache_size: maximum size of the build cache, in bytes
+        build_cache_remote: URL of a remote build cache (see remotecache.py),
+                            looked up on local misses. If no build_cache is
+                            given, the default one is used
+        shared_target: share a Cargo target dir between Rust modules with the
+                       same target triple (see glob.get_cargo_target_dir)
+        persistent_connections: maximum number of persistent connections to
+                                each event manager (see connpool.py). By
+                                default, each command opens a new connection
+        """
+        self.workspace = os.path.abspath(workspace)
+        self.build_dir = os.path.abspath(build_dir or
+                                         os.path.join(self.workspace, "build"))
+        self.build_mode = glob.BuildMode.from_str(build_mode)
+        self.config_file = self.resolve_path(config_file)
+        self.shared_target = shared_target
+        self.persistent_connections = persistent_connections
+        self.build_cache = None
+
+        if build_cache_remote is not None:
+            from . import remotecache
+            self.build_cache = buildcache.BuildCache(
+                    build_cache or buildcache.default_dir(), build_cache_size,
+                    remotecache.HTTPCache(build_cache_remote))
+        elif build_cache is not None:
+            self.build_cache = buildcache.BuildCache(build_cache,
+                                                     build_cache_size)
+
+        os.makedirs(self.build_dir, exist_ok=True)
+
+        # the context variables in glob are set only in this context, which is
+        # the one all the coroutines of this deployer run in
+        self.__context = contextvars.copy_context()
+        self.__context.run(self.__init_context)
+
+        self.config = self.__context.run(config.load, self.config_file,
+                                         output_type, cache, limits)
+        self.__context.run(glob.set_build_jobs, self.config.limits.get("build"))
+
+
+    def resolve_path(self, path):
+        return os.path.join(self.workspace, path)
+
+
+    async def build(self, module=None):
+        await self.__run(self.config.build_async(module))
+
+
+    async def deploy(self, in_order=False, module=None, waves=False):
+        await self.__run(self.config.deploy_async(in_order, module, waves))
+
+
+    async def attest(self, module=None):
+        await self.__run(self.config.attest_async(module))
+
+
+    async def connect(self, connection=None):
+        await self.__run(self.config.connect_async(connection))
+
+
+    async def register(self, event=None):
+        await self.__run(self.config.register_async(event))
+
+
+    async def up(self, in_order=False, result=None, waves=False):
+        """
+        Build, deploy, attest, connect and register everything, without
+        waiting for all the entities of a step before starting the next one.
+
+        Each change is appended to the journal of the input descriptor as soon
+        as it happens, and the final configuration is written to `result`
+        (default: the input descriptor) at the end. If the deployment fails,
+        the journal keeps all the work done, and a subsequent up on the same
+        input descriptor resumes from there.
+        """
+        file = self.config_file if result is None else self.resolve_path(result)
+        await self.__run(self.__up(in_order, file, waves))
+
+
+    def plan(self, in_order=False, waves=False):
+        """
+        Returns a description of the tasks that up would run, one per line
+        """
+        return self.config.plan_up(in_order, waves).format_plan()
+
+
+    async def call(self, module, entry, arg=None):
+        module = self.config.get_module(module)
+        return await self.__run(module.call(entry, arg))
+
+
+    async def dump(self, file=None):
+        file = self.config_file if file is None else self.resolve_path(file)
+
+        logging.info('Writing post-deployment configuration to %s', file)
+        await self.__run(config.dump_config_async(self.config, file))
+
+
+    async def cleanup(self):
+        await self.__run(self.config.cleanup_async())
+        jobserver.log_stats(self.__context.run(glob.get_jobserver))
+
+
+    async def __up(self, in_order, file, waves):
+        dirty = {}
+        flusher = None
+
+        async def flush():
+            while dirty:
+                entities = list(dirty)
+                dirty.clear()
+                await config.journal_config_async(self.config, entities)
+
+        # changes are written in background: those that happen while a write
+        # is in progress are written together by the next one
+        def on_change(*entities):
+            nonlocal flusher
+            dirty.update(dict.fromkeys(entities))
+
+            if flusher is None or flusher.done():
+                flusher = asyncio.ensure_future(flush())
+
+        try:
+            await self.config.up_async(in_order, on_change, waves)
+        finally:
+            if flusher is not None:
+                await flusher
+
+        logging.info('Writing post-deployment configuration to %s', file)
+        await config.dump_config_async(self.config, file)
+        # the result includes all the changes in the journal of the input
+        journal.remove(self.config.file_name)
+
+
+    def __init_context(self):
+        glob.set_workspace(self.workspace)
+        glob.set_build_dir(self.build_dir)
+        glob.set_build_mode(self.build_mode)
+        glob.set_build_cache(self.build_cache)
+        glob.set_shared_target(self.shared_target)
+
+        if self.persistent_connections is not None:
+            from . import connpool
+            glob.set_connection_pool(
+                    connpool.ConnectionPool(self.persistent_connections))
+
+
+    # The task inherits the context of this deployer, as do all the tasks and
+    # futures created by the coroutine
+    def __run(self, coro):
+        return self.__context.run(asyncio.ensure_future, coro)
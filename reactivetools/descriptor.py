@@ -1,6 +1,8 @@
 import json
-import yaml
 import os
+import binascii
+import shutil
+import tempfile
 from enum import IntEnum
 
 
@@ -8,9 +10,84 @@ class Error(Exception):
     pass
 
 
+# Byte arrays (e.g., keys) are stored as raw bytes in binary descriptors,
+# and as hex strings in text descriptors
+def hexlify_bytes(obj):
+    if isinstance(obj, (bytes, bytearray)):
+        return binascii.hexlify(obj).decode('ascii')
+
+    raise TypeError("Object of type {} is not serializable".format(
+            obj.__class__.__name__))
+
+
+__yaml = None
+
+# PyYAML is imported on first use, as it is quite slow to import. The libyaml
+# bindings are used if available, they are much faster
+def _import_yaml():
+    global __yaml
+
+    if __yaml is None:
+        import yaml
+
+        try:
+            from yaml import CFullLoader as Loader, CDumper as BaseDumper
+        except ImportError:
+            from yaml import FullLoader as Loader, Dumper as BaseDumper
+
+        class Dumper(BaseDumper):
+            pass
+
+        represent_bytes = lambda dumper, data: \
+                                dumper.represent_str(hexlify_bytes(data))
+        Dumper.add_representer(bytes, represent_bytes)
+        Dumper.add_representer(bytearray, represent_bytes)
+
+        __yaml = yaml, Loader, Dumper
+
+    return __yaml
+
+
+# The umask can only be read by changing it, which affects the whole process:
+# it is read once at import, before any file is created by other threads (e.g.,
+# descriptors are dumped in the pool of blocking work, see tools.run_blocking)
+def _get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+UMASK = _get_umask()
+
+
+# Makes a rename in `dir` durable. Not supported by all platforms and file
+# systems (e.g., on Windows), where it is skipped
+def _fsync_dir(dir):
+    try:
+        fd = os.open(dir, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _import_msgpack():
+    try:
+        import msgpack
+    except:
+        raise Error("msgpack not installed! Check README.md")
+
+    return msgpack
+
+
 class DescriptorType(IntEnum):
     JSON    = 0
     YAML    = 1
+    MSGPACK = 2
 
     @staticmethod
     def from_str(type):
@@ -23,37 +100,114 @@ class DescriptorType(IntEnum):
             return DescriptorType.JSON
         if type_lower == "yaml":
             return DescriptorType.YAML
+        if type_lower == "msgpack":
+            return DescriptorType.MSGPACK
 
         raise Error("Bad deployment descriptor type: {}".format(type))
 
 
     @staticmethod
-    def load_any(file):
+    def read(file):
         if not os.path.exists(file):
             raise Error("Input file does not exist")
 
+        with open(file, 'rb') as f:
+            return f.read()
+
+
+    @staticmethod
+    def load_any(file):
+        return DescriptorType.loads_any(DescriptorType.read(file))
+
+
+    @staticmethod
+    def loads_any(data):
+        type = DescriptorType.sniff(data)
+
         try:
-            return DescriptorType.JSON.load(file), DescriptorType.JSON
+            return type.loads(data), type
         except:
+            pass
+
+        # JSON is a subset of YAML, so a YAML file might look like a JSON one
+        if type == DescriptorType.JSON:
             try:
-                return DescriptorType.YAML.load(file), DescriptorType.YAML
+                return DescriptorType.YAML.loads(data), DescriptorType.YAML
             except:
-                raise Error("Input file is not a JSON, nor a YAML")
+                pass
+
+        raise Error("Input file is not a JSON, a YAML, nor a MSGPACK")
+
+
+    @staticmethod
+    def sniff(data):
+        # A msgpack descriptor is a map: fixmap (0x80-0x8f), map16 or map32
+        first = data[:1]
+        if first and (0x80 <= first[0] <= 0x8f or first[0] in (0xde, 0xdf)):
+            return DescriptorType.MSGPACK
+
+        # A JSON descriptor is an object (or an array): look at the first char
+        if data.lstrip(b'\xef\xbb\xbf \t\r\n')[:1] in (b'{', b'['):
+            return DescriptorType.JSON
+
+        return DescriptorType.YAML
+
 
+    # strict_keys: msgpack only, map keys must be strings (as in JSON). Data
+    # that is not a descriptor (e.g., the cache of a validated configuration)
+    # might have keys of any type
+    def load(self, file, strict_keys=True):
+        with open(file, 'rb') as f:
+            return self.loads(f.read(), strict_keys)
 
-    def load(self, file):
-        with open(file, 'r') as f:
-            if self == DescriptorType.JSON:
-                return json.load(f)
 
-            if self == DescriptorType.YAML:
-                return yaml.load(f, Loader=yaml.FullLoader)
+    def loads(self, data, strict_keys=True):
+        if self == DescriptorType.JSON:
+            return json.loads(data)
 
+        if self == DescriptorType.YAML:
+            yaml, loader, _ = _import_yaml()
+            return yaml.load(data, Loader=loader)
 
+        if self == DescriptorType.MSGPACK:
+            return _import_msgpack().unpackb(data, raw=False,
+                                             strict_map_key=strict_keys)
+
+
+    # The file is written with write-and-rename: either the old or the new
+    # contents are visible, even if the process crashes while writing
     def dump(self, file, data):
-        with open(file, 'w') as f:
-            if self == DescriptorType.JSON:
-                json.dump(data, f, indent=4)
+        dir = os.path.dirname(os.path.abspath(file))
+        fd, tmp = tempfile.mkstemp(dir=dir, prefix=".", suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, 'wb' if self == DescriptorType.MSGPACK else 'w') as f:
+                self.__dump(f, data)
+                # the data must be on disk before the rename, otherwise a
+                # crash might leave an empty file in place of the old one
+                f.flush()
+                os.fsync(f.fileno())
+
+            if os.path.exists(file):
+                shutil.copymode(file, tmp)
+            else:
+                os.chmod(tmp, 0o666 & ~UMASK)
+
+            os.replace(tmp, file)
+        except:
+            os.remove(tmp)
+            raise
+
+        _fsync_dir(dir)
+
+
+    def __dump(self, f, data):
+        if self == DescriptorType.JSON:
+            json.dump(data, f, indent=4, default=hexlify_bytes)
+
+        if self == DescriptorType.YAML:
+            yaml, _, dumper = _import_yaml()
+            yaml.dump(data, f, Dumper=dumper)
 
-            if self == DescriptorType.YAML:
-                yaml.dump(data, f)
+        if self == DescriptorType.MSGPACK:
+            f.write(_import_msgpack().packb(data, use_bin_type=True))
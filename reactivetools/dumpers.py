@@ -1,7 +1,6 @@
 import asyncio
 import functools
 import types
-import binascii
 
 @functools.singledispatch
 def dump(obj):
@@ -13,10 +12,12 @@ def _(l):
     return [dump(e) for e in l]
 
 
+# Byte arrays are kept as they are: the DescriptorType takes care of
+# converting them to hex strings, if the format does not support binary data
 @dump.register(bytes)
 @dump.register(bytearray)
 def _(bs):
-    return binascii.hexlify(bs).decode('ascii')
+    return bytes(bs)
 
 
 @dump.register(str)
@@ -30,11 +31,36 @@ def _(t):
     return { t[1] : t[0] }
 
 
+# Inside a running event loop, coroutines cannot be run to completion here:
+# they are left in the result, and awaited by dump_async
 @dump.register(types.CoroutineType)
 def _(coro):
-    return dump(asyncio.get_event_loop().run_until_complete(coro))
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return dump(asyncio.get_event_loop().run_until_complete(coro))
+
+    return coro
 
 
 @dump.register(dict)
 def _(dict):
     return dict
+
+
+# Coroutine. Same as dump, but can be used inside a running event loop
+async def dump_async(obj):
+    return await __resolve(dump(obj))
+
+
+async def __resolve(obj):
+    if asyncio.iscoroutine(obj):
+        return await __resolve(dump(await obj))
+
+    if isinstance(obj, list):
+        return [await __resolve(e) for e in obj]
+
+    if isinstance(obj, dict):
+        return {k: await __resolve(v) for k, v in obj.items()}
+
+    return obj
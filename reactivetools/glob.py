@@ -1,8 +1,8 @@
 from enum import IntEnum
+from contextvars import ContextVar
+import asyncio
 import os
 
-BUILD_DIR = os.path.join(os.getcwd(), "build")
-
 class Error(Exception):
     pass
 
@@ -30,11 +30,103 @@ class BuildMode(IntEnum):
         raise Error("BuildMode::to_str failed: this should never happen")
 
 
-__BUILD_MODE = BuildMode.DEBUG
+# The workspace, the build directory and the build mode are context variables,
+# so that different deployments (see deployer.py) can run in the same process,
+# each in its own context. If not set, the current directory is the workspace
+# and <current directory>/build is the build directory
+__WORKSPACE = ContextVar("workspace", default=None)
+__BUILD_DIR = ContextVar("build_dir", default=None)
+__BUILD_MODE = ContextVar("build_mode", default=BuildMode.DEBUG)
 
 def set_build_mode(mode):
-    global __BUILD_MODE
-    __BUILD_MODE = BuildMode.from_str(mode)
+    if not isinstance(mode, BuildMode):
+        mode = BuildMode.from_str(mode)
+
+    __BUILD_MODE.set(mode)
 
 def get_build_mode():
-    return __BUILD_MODE
+    return __BUILD_MODE.get()
+
+def set_workspace(workspace):
+    __WORKSPACE.set(os.path.abspath(workspace))
+
+def get_workspace():
+    return __WORKSPACE.get() or os.getcwd()
+
+def set_build_dir(build_dir):
+    __BUILD_DIR.set(os.path.abspath(build_dir))
+
+def get_build_dir():
+    return __BUILD_DIR.get() or os.path.join(os.getcwd(), "build")
+
+# Paths in the deployment descriptor are relative to the workspace
+def resolve_path(path):
+    return os.path.abspath(os.path.join(get_workspace(), path))
+
+# Maximum number of build jobs (e.g., sancus-cc processes, or the rustc
+# processes run by cargo) running at the same time, as "make -j", enforced by
+# a jobserver (see jobserver.py). Not bounded if not set
+__JOBSERVER = ContextVar("jobserver", default=None)
+
+class _NoLimit:
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, *args):
+        pass
+
+def set_build_jobs(jobs):
+    from .jobserver import Jobserver
+    __JOBSERVER.set(None if jobs is None else Jobserver(jobs))
+
+def get_jobserver():
+    return __JOBSERVER.get()
+
+# Usage: async with glob.build_slot(): <run a build process>
+def build_slot():
+    return __JOBSERVER.get() or _NoLimit()
+
+# Cache of build artifacts (see buildcache.py), or None if disabled
+__BUILD_CACHE = ContextVar("build_cache", default=None)
+
+def set_build_cache(cache):
+    __BUILD_CACHE.set(cache)
+
+def get_build_cache():
+    return __BUILD_CACHE.get()
+
+# Rust modules can share a Cargo target directory, so that common crates are
+# built only once. There is one directory per (target triple, build mode),
+# therefore e.g. native and SGX builds do not block each other
+__SHARED_TARGET = ContextVar("shared_target", default=False)
+__CARGO_LOCKS = {}
+
+def set_shared_target(shared):
+    __SHARED_TARGET.set(shared)
+
+# triple: None for the host. Returns None if the target dir is not shared
+def get_cargo_target_dir(triple=None):
+    if not __SHARED_TARGET.get():
+        return None
+
+    name = "{}-{}".format(triple or "host", get_build_mode().to_str())
+    return os.path.join(get_build_dir(), "cargo-target", name)
+
+# Cargo locks the whole target directory during a build: builds using the same
+# directory are run one at a time, instead of blocking on the lock while
+# holding a build slot
+def cargo_lock(target_dir):
+    if target_dir not in __CARGO_LOCKS:
+        __CARGO_LOCKS[target_dir] = asyncio.Lock()
+
+    return __CARGO_LOCKS[target_dir]
+
+# Pool of persistent connections to the event managers (see connpool.py), or
+# None to open a new connection for each command
+__CONNECTION_POOL = ContextVar("connection_pool", default=None)
+
+def set_connection_pool(pool):
+    __CONNECTION_POOL.set(pool)
+
+def get_connection_pool():
+    return __CONNECTION_POOL.get()
@@ -0,0 +1,195 @@
+import asyncio
+import collections
+import logging
+import os
+import shutil
+import tempfile
+import time
+import weakref
+
+# GNU make compatible jobserver, capping the number of compiler processes run
+# by all the concurrent builds (cargo, sancus-cc, ...)
+#
+# The jobserver is a FIFO holding one token (a byte) per job. Before running a
+# build process, reactive-tools takes a token, which is the implicit token of
+# the process, and gives it back when the process exits. Build processes
+# supporting the jobserver protocol (e.g., cargo and the rustc processes it
+# spawns) find it in MAKEFLAGS/CARGO_MAKEFLAGS, and take an additional token
+# from it for each parallel job. Therefore, the total number of jobs never
+# exceeds the number of tokens.
+#
+# Children get blocking descriptors of the FIFO, as in the classic pipe-based
+# protocol, while reactive-tools reads it through a separate non-blocking
+# descriptor, from the event loop.
+
+TOKEN = b'+'
+
+
+class Error(Exception):
+    pass
+
+
+class Stats:
+    def __init__(self):
+        self.acquired = 0
+        self.waited = 0
+        self.wait_time = 0
+        self.max_wait_time = 0
+
+
+    def add(self, wait_time, waited):
+        self.acquired += 1
+        self.waited += waited
+        self.wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+
+    def __str__(self):
+        return "{} build processes, {} of which waited for a job slot, " \
+               "{:.3f}s of waiting in total (max {:.3f}s)".format(
+                   self.acquired, self.waited, self.wait_time,
+                   self.max_wait_time)
+
+
+class Jobserver:
+    def __init__(self, jobs):
+        if jobs < 1:
+            raise Error("The number of jobs must be positive")
+
+        self.jobs = jobs
+        self.stats = Stats()
+        self.__waiters = collections.deque()
+        self.__reading = False
+        # tokens taken with `async with`
+        self.__tokens = []
+
+        # the FIFO is removed right away: it lives as long as its descriptors
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, "jobserver")
+
+        try:
+            os.mkfifo(path)
+            self.__fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+            self.__child_r = os.open(path, os.O_RDONLY)
+            self.__child_w = os.open(path, os.O_WRONLY)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        os.write(self.__fd, TOKEN * jobs)
+
+        self.__finalizer = weakref.finalize(self, _close,
+                            [self.__fd, self.__child_r, self.__child_w])
+
+
+    @property
+    def fds(self):
+        """
+        File descriptors to be inherited by the build processes
+        """
+        return (self.__child_r, self.__child_w)
+
+
+    def get_env(self, env=None):
+        """
+        Returns `env` (default: the environment of this process) with the
+        variables pointing build processes to this jobserver
+        """
+        env = dict(os.environ if env is None else env)
+        flags = "-j{} --jobserver-fds={r},{w} --jobserver-auth={r},{w}".format(
+                    self.jobs, r=self.__child_r, w=self.__child_w)
+
+        env["MAKEFLAGS"] = flags
+        env["CARGO_MAKEFLAGS"] = flags
+        return env
+
+
+    async def acquire(self):
+        start = time.perf_counter()
+        token = self.__read() if not self.__waiters else None
+        waited = token is None
+
+        if waited:
+            fut = asyncio.get_event_loop().create_future()
+            self.__waiters.append(fut)
+            self.__start_reading()
+
+            try:
+                token = await fut
+            except asyncio.CancelledError:
+                # the token might have been handed over right before cancelling
+                if fut.done() and not fut.cancelled():
+                    self.release(fut.result())
+                raise
+
+        self.stats.add(time.perf_counter() - start if waited else 0, waited)
+        return token
+
+
+    def release(self, token=TOKEN):
+        os.write(self.__fd, token)
+
+
+    def close(self):
+        self.__finalizer()
+
+
+    # Usage: async with jobserver: <run a build process>
+    async def __aenter__(self):
+        self.__tokens.append(await self.acquire())
+
+
+    async def __aexit__(self, *args):
+        self.release(self.__tokens.pop())
+
+
+    def __read(self):
+        try:
+            token = os.read(self.__fd, 1)
+        except BlockingIOError:
+            return None
+
+        if not token:
+            raise Error("Jobserver closed")
+
+        return token
+
+
+    # Tokens are handed over to the waiters in order, as soon as they are
+    # returned by any process
+    def __start_reading(self):
+        if not self.__reading:
+            asyncio.get_event_loop().add_reader(self.__fd, self.__on_readable)
+            self.__reading = True
+
+
+    def __on_readable(self):
+        while self.__waiters:
+            fut = self.__waiters[0]
+
+            if fut.done():
+                self.__waiters.popleft()
+                continue
+
+            token = self.__read()
+            if token is None:
+                # taken by a build process in the meantime
+                return
+
+            self.__waiters.popleft()
+            fut.set_result(token)
+
+        asyncio.get_event_loop().remove_reader(self.__fd)
+        self.__reading = False
+
+
+def _close(fds):
+    for fd in fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def log_stats(jobserver):
+    if jobserver is not None and jobserver.stats.acquired > 0:
+        logging.info("Jobserver: {}".format(jobserver.stats))
@@ -0,0 +1,92 @@
+import os
+import json
+import logging
+
+from .descriptor import hexlify_bytes
+
+# The journal is an append-only file stored next to a deployment descriptor
+# (<descriptor>.journal), that records state changes without rewriting the
+# whole descriptor.
+#
+# Each line is a JSON object. The first line identifies the descriptor the
+# journal refers to (i.e., the hash of its contents); each of the other lines
+# contains the new state of an entity of the descriptor. A journal that refers
+# to a different version of the descriptor (e.g., because the descriptor has
+# been rewritten in the meantime) is stale, and it is ignored.
+
+
+def get_file(descriptor):
+    return "{}.journal".format(descriptor)
+
+
+def append(descriptor, base, records):
+    file = get_file(descriptor)
+
+    # a stale journal is overwritten
+    mode = 'a' if _read_base(file) == base else 'w'
+
+    with open(file, mode) as f:
+        if mode == 'w':
+            f.write(_encode({"base": base}))
+
+        for record in records:
+            f.write(_encode(record))
+
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read(descriptor, base):
+    file = get_file(descriptor)
+
+    try:
+        with open(file, 'r') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+
+    if _decode(lines[0] if lines else "").get("base") != base:
+        logging.warning("Ignoring stale journal {}".format(file))
+        return []
+
+    records = []
+    for line in lines[1:]:
+        record = _decode(line)
+
+        # a crash during an append might leave a truncated record at the end
+        if not record:
+            logging.warning("Ignoring truncated record in journal {}".format(file))
+            break
+
+        records.append(record)
+
+    logging.debug("Read {} records from journal {}".format(len(records), file))
+    return records
+
+
+def remove(descriptor):
+    try:
+        os.remove(get_file(descriptor))
+    except FileNotFoundError:
+        pass
+
+
+def _read_base(file):
+    try:
+        with open(file, 'r') as f:
+            return _decode(f.readline()).get("base")
+    except FileNotFoundError:
+        return None
+
+
+def _encode(record):
+    return json.dumps(record, default=hexlify_bytes) + "\n"
+
+
+def _decode(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return {}
+
+    return record if isinstance(record, dict) else {}
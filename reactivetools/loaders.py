@@ -2,6 +2,7 @@ import binascii
 import os
 
 from . import tools
+from . import glob
 
 class Error(Exception):
     pass
@@ -18,6 +19,10 @@ def parse_key(key_str):
     if key_str is None:
         return None
 
+    # binary descriptors store keys as raw bytes
+    if isinstance(key_str, (bytes, bytearray)):
+        return bytes(key_str)
+
     return binascii.unhexlify(key_str)
 
 
@@ -25,4 +30,4 @@ def parse_file_name(file_name):
     if file_name is None:
         return None
 
-    return os.path.abspath(file_name)
+    return glob.resolve_path(file_name)
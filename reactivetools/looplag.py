@@ -0,0 +1,109 @@
+import asyncio
+import logging
+
+# Monitor of the latency of the event loop
+#
+# Blocking work (see tools.run_blocking) should never run on the event loop:
+# while it runs, no other coroutine makes progress, e.g., builds are not
+# started and commands to the nodes are not sent. The monitor wakes up every
+# `interval` seconds and measures how late it was woken up (the lag), which is
+# how long the event loop was blocked, minus at most `interval`. Lags above
+# `threshold` are reported as warnings.
+#
+# The callbacks blocking the loop can be found by running with the asyncio
+# debug mode enabled (PYTHONASYNCIODEBUG=1): its slow callback duration is set
+# to the threshold.
+
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_INTERVAL = 0.05
+
+
+class Error(Exception):
+    pass
+
+
+class Stats:
+    def __init__(self):
+        self.samples = 0
+        self.blocked = 0
+        self.blocked_time = 0
+        self.max_lag = 0
+
+
+    def add(self, lag, blocked):
+        self.samples += 1
+        self.max_lag = max(self.max_lag, lag)
+
+        if blocked:
+            self.blocked += 1
+            self.blocked_time += lag
+
+
+    def __str__(self):
+        return "blocked {} times for more than the threshold, " \
+               "{:.3f}s in total (max lag {:.3f}s)".format(
+                   self.blocked, self.blocked_time, self.max_lag)
+
+
+class LoopLagMonitor:
+    def __init__(self, threshold=DEFAULT_THRESHOLD, interval=DEFAULT_INTERVAL):
+        """
+        threshold: lags (in seconds) above which the event loop is considered
+                   blocked and a warning is logged
+        interval: time between two measurements, in seconds
+        """
+        if threshold <= 0 or interval <= 0:
+            raise Error("The threshold and interval must be positive")
+
+        self.threshold = threshold
+        self.interval = interval
+        self.stats = Stats()
+        self.__task = None
+
+
+    def start(self, loop=None):
+        if self.__task is not None:
+            return
+
+        loop = loop or asyncio.get_event_loop()
+        loop.slow_callback_duration = self.threshold
+        self.__task = loop.create_task(self.__run(loop))
+
+
+    async def stop(self):
+        task, self.__task = self.__task, None
+
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+
+    # Usage: async with LoopLagMonitor(): <run some coroutines>
+    async def __aenter__(self):
+        self.start()
+        return self
+
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+
+    async def __run(self, loop):
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0, loop.time() - start - self.interval)
+            blocked = lag > self.threshold
+
+            self.stats.add(lag, blocked)
+
+            if blocked:
+                logging.warning("Event loop blocked for {:.3f}s".format(lag))
+
+
+def log_stats(monitor):
+    if monitor is not None and monitor.stats.samples > 0:
+        logging.info("Event loop: {}".format(monitor.stats))
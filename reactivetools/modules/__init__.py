@@ -1,7 +1,7 @@
+import importlib
+import sys
+
 from .base import Module
-from .sancus import SancusModule
-from .native import NativeModule
-from .sgx import SGXModule
 
 module_rules = {
     "sancus"    : "sancus.yaml",
@@ -9,14 +9,21 @@ module_rules = {
     "native"    : "native.yaml"
 }
 
-module_funcs = {
-    "sancus"    : SancusModule.load,
-    "sgx"       : SGXModule.load,
-    "native"    : NativeModule.load
+# Module classes are imported only when a module of that type is actually
+# used, to avoid loading the dependencies of all the architectures at startup
+module_classes = {
+    "sancus"    : ("sancus", "SancusModule"),
+    "sgx"       : ("sgx", "SGXModule"),
+    "native"    : ("native", "NativeModule")
 }
 
-module_cleanup_coros = [
-    SancusModule.cleanup,
-    SGXModule.cleanup,
-    NativeModule.cleanup
-]
+
+def get_module_class(type):
+    module, cls = module_classes[type]
+    return getattr(importlib.import_module("." + module, __name__), cls)
+
+
+def get_module_cleanup_coros():
+    # Classes that have not been imported have nothing to clean up
+    return [get_module_class(type).cleanup for type, (module, _) in module_classes.items()
+                if "{}.{}".format(__name__, module) in sys.modules]
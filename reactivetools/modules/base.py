@@ -2,6 +2,7 @@ from abc import ABC, abstractmethod
 import os
 import logging
 from .. import glob
+from ..scheduler import node_resource
 
 class Error(Exception):
     pass
@@ -31,7 +32,7 @@ class Module(ABC):
 
         # create temp dir
         try:
-            os.mkdir(os.path.join(glob.BUILD_DIR, name))
+            os.mkdir(os.path.join(glob.get_build_dir(), name))
         except FileExistsError:
             pass
         except:
@@ -264,6 +265,50 @@ class Module(ABC):
         pass
 
 
+    """
+    ### Description ###
+    Add the tasks needed to bring up the module to a Scheduler (scheduler.py):
+        - build:<name> and deploy:<name>, if the module is not deployed yet
+        - attest:<name>, if the module is not attested yet
+
+    ### Parameters ###
+    self: Module object
+    scheduler (Scheduler): scheduler where to add the tasks
+
+    ### Returns ###
+    """
+    def emit_tasks(self, scheduler):
+        deploy = None
+
+        if not self.deployed:
+            build = scheduler.add("build:{}".format(self.name), self.build,
+                            resources=["build"], priority=self.priority)
+            deploy = scheduler.add("deploy:{}".format(self.name), self.deploy,
+                            deps=[build], resources=[node_resource(self.node)],
+                            priority=self.priority, entities=[self])
+
+        if not self.attested:
+            scheduler.add("attest:{}".format(self.name), self.attest,
+                            deps=[deploy], resources=self._get_attest_resources(),
+                            priority=self.priority, entities=[self])
+
+
+    """
+    ### Description ###
+    Get the resources used by the attestation of the module (see scheduler.py)
+
+    By default, attestation only uses the node of the module
+
+    ### Parameters ###
+    self: Module object
+
+    ### Returns ###
+    `list`: list of resource names
+    """
+    def _get_attest_resources(self):
+        return [node_resource(self.node)]
+
+
     """
     ### Description ###
     Coroutine. Call an entrypoint of the module
@@ -274,9 +319,10 @@ class Module(ABC):
     arg (bytes): argument to pass as a byte array (can be None)
 
     ### Returns ###
+    `bytes`: payload of the response (None if the call failed)
     """
     async def call(self, entry, arg=None):
-        await self.node.call(self, entry, arg)
+        return await self.node.call(self, entry, arg)
 
 
     """
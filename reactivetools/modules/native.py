@@ -1,12 +1,15 @@
 import asyncio
+import binascii
 import logging
 import os
 
 from .base import Module
 
-from ..nodes import NativeNode
+from ..nodes.native import NativeNode
 from .. import tools
 from .. import glob
+from .. import buildcache
+from .. import codegen
 from ..crypto import Encryption
 from ..dumpers import *
 from ..loaders import *
@@ -27,11 +30,15 @@ class NativeModule(Module):
 
         self.__generate_fut = tools.init_future(data, key)
         self.__build_fut = tools.init_future(binary)
+        self.__cached_fut = None
+        # the build cache is not used if the generated code is already given
+        self.__cacheable = data is None
+        self.__cache_key = None
 
         self.features = [] if features is None else features
         self.id = id if id is not None else node.get_module_id()
         self.port = port or self.node.reactive_port + self.id
-        self.output = os.path.join(glob.BUILD_DIR, name)
+        self.output = os.path.join(glob.get_build_dir(), name)
         self.folder = folder
 
 
@@ -139,6 +146,11 @@ class NativeModule(Module):
         self.attested = True
 
 
+    def _get_attest_resources(self):
+        # no remote attestation for native modules
+        return []
+
+
     async def get_id(self):
         return self.id
 
@@ -229,14 +241,18 @@ class NativeModule(Module):
 
 
     async def __generate_code(self):
+        cached = await self.__get_cached()
+        if cached is not None:
+            return cached
+
         try:
-            import rustsgxgen
+            rustsgxgen = await codegen.import_generator()
         except:
             raise Error("rust-sgx-gen not installed! Check README.md")
 
         args = Object()
 
-        args.input = self.folder
+        args.input = glob.resolve_path(self.folder)
         args.output = self.output
         args.moduleid = self.id
         args.emport = self.node.deploy_port
@@ -244,23 +260,70 @@ class NativeModule(Module):
         args.spkey = None
         args.print = None
 
-        data, key = rustsgxgen.generate(args)
+        data, key = await codegen.generate(args)
         logging.info("Generated code for module {}".format(self.name))
 
         return data, key
 
 
     async def __build(self):
-        await self.generate_code()
+        if await self.__get_cached() is not None:
+            return self.__get_binary_path()
+
+        data, key = await self.generate_code()
 
         release = "--release" if glob.get_build_mode() == glob.BuildMode.RELEASE else ""
         features = "--features " + " ".join(self.features) if self.features else ""
 
         cmd = BUILD_APP.format(release, features, self.output).split()
-        await tools.run_async(*cmd)
-
-        binary = os.path.join(self.output,
-                        "target", glob.get_build_mode().to_str(), self.folder)
+        binary = self.__get_binary_path()
+        await tools.run_cargo_build(*cmd,
+                    manifest=os.path.join(self.output, "Cargo.toml"),
+                    name=self.folder, binary=binary, id=self.name)
 
         logging.info("Built module {}".format(self.name))
+
+        if self.__cache_key is not None:
+            await glob.get_build_cache().store(self.__cache_key,
+                {"binary": binary},
+                {"data": data, "key": binascii.hexlify(key).decode('ascii')})
+
         return binary
+
+
+    def __get_binary_path(self):
+        return os.path.join(self.output,
+                        "target", glob.get_build_mode().to_str(), self.folder)
+
+
+    # Returns the generated data and key of the cached build of this module,
+    # after copying its binary to the build dir, or None if not cached
+    async def __get_cached(self):
+        if self.__cached_fut is None:
+            self.__cached_fut = asyncio.ensure_future(self.__fetch_cached())
+
+        return await self.__cached_fut
+
+
+    async def __fetch_cached(self):
+        cache = glob.get_build_cache()
+        if cache is None or not self.__cacheable:
+            return None
+
+        self.__cache_key = await buildcache.make_key("native", {
+                "toolchain": await buildcache.toolchain_version("cargo", "rustc"),
+                "codegen": buildcache.package_version("rust-sgx-gen"),
+                "folder": self.folder,
+                "id": self.id,
+                "emport": self.node.deploy_port,
+                "features": self.features,
+                "mode": glob.get_build_mode().to_str()
+            }, trees=[glob.resolve_path(self.folder)])
+
+        cached = await cache.fetch(self.__cache_key,
+                                   {"binary": self.__get_binary_path()})
+        if cached is None:
+            return None
+
+        logging.info("Using cached build of module {}".format(self.name))
+        return cached["data"], parse_key(cached["key"])
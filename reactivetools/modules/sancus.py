@@ -1,25 +1,38 @@
 import logging
 import asyncio
 import binascii
+import hashlib
+import os
+import re
+import tempfile
 from enum import Enum
 from collections import namedtuple
 
-from elftools.elf import elffile
-
 from .base import Module
-from ..nodes import SancusNode
+from ..nodes.sancus import SancusNode
 from .. import tools
+from .. import glob
+from .. import buildcache
 from ..crypto import Encryption
 from ..dumpers import *
 from ..loaders import *
 
+# Directory of the object files, shared by all modules (see __build)
+OBJECTS_DIR = "sancus-objects"
+
+# Linker used to compute the module keys, see _calculate_key
+LINKER = "msp430-ld"
+
+# Local headers, i.e., #include "header.h"
+INCLUDE_RE = re.compile(r'^\s*#\s*include\s*"([^"]+)"', re.MULTILINE)
+
 class Error(Exception):
     pass
 
 
 class SancusModule(Module):
     def __init__(self, name, node, priority, deployed, nonce, attested, files,
-            cflags, ldflags, binary, id, symtab, key):
+            cflags, ldflags, binary, id, symtab, key, symbols):
         super().__init__(name, node, priority, deployed, nonce, attested)
 
         self.files = files
@@ -29,6 +42,10 @@ class SancusModule(Module):
         self.__build_fut = tools.init_future(binary)
         self.__deploy_fut = tools.init_future(id, symtab)
         self.__key_fut = tools.init_future(key)
+        self.__link_fut = None
+        self.__symbols_fut = None
+        # symbols loaded from the descriptor, checked against the binary
+        self.__loaded_symbols = symbols
         self.__attest_fut = tools.init_future(attested if attested else None)
 
 
@@ -48,9 +65,10 @@ class SancusModule(Module):
         id = mod_dict.get('id')
         symtab = parse_file_name(mod_dict.get('symtab'))
         key = parse_key(mod_dict.get('key'))
+        symbols = mod_dict.get('symbols')
 
         return SancusModule(name, node, priority, deployed, nonce, attested,
-                files, cflags, ldflags, binary, id, symtab, key)
+                files, cflags, ldflags, binary, id, symtab, key, symbols)
 
 
     def dump(self):
@@ -68,7 +86,8 @@ class SancusModule(Module):
             "binary": dump(self.binary) if self.deployed else None,
             "id": dump(self.id) if self.deployed else None,
             "symtab": dump(self.symtab) if self.deployed else None,
-            "key": dump(self.key) if self.deployed else None
+            "key": dump(self.key) if self.deployed else None,
+            "symbols": dump(self.symbols) if self.deployed else None
         }
 
 
@@ -95,6 +114,15 @@ class SancusModule(Module):
 
         return await self.__key_fut
 
+    # IDs of the IOs and entry points, extracted from the binary (see
+    # _get_symbols): {"binary": sha256, "io": {name: id}, "entry": {name: id}}
+    @property
+    async def symbols(self):
+        if self.__symbols_fut is None:
+            self.__symbols_fut = asyncio.ensure_future(self.__get_symbols())
+
+        return await self.__symbols_fut
+
 
     # --- Implement abstract methods --- #
 
@@ -107,7 +135,7 @@ class SancusModule(Module):
 
     async def deploy(self):
         if self.__deploy_fut is None:
-            self.__deploy_fut = asyncio.ensure_future(self.node.deploy(self))
+            self.__deploy_fut = asyncio.ensure_future(self.__deploy())
 
         return await self.__deploy_fut
 
@@ -181,61 +209,172 @@ class SancusModule(Module):
         return await self._get_io_id(io)
 
 
+    # Builds are incremental: objects are identified by a hash of their inputs
+    # (source, local headers, compiler and flags) and shared by all modules in
+    # `build/sancus-objects`, while the binary is identified by a hash of its
+    # objects and of the linker flags (including the connection count). Only
+    # the objects that changed are compiled, and the module is relinked only if
+    # one of its objects or the linker flags changed.
     async def __build(self):
-        logging.info('Building module %s from %s',
-                     self.name, ', '.join(map(str, self.files)))
-
         config = self._get_build_config(tools.get_verbosity())
-        objects = {str(p): tools.create_tmp(suffix='.o', dir=self.name) for p in self.files}
-
         cflags = config.cflags + self.cflags
-        build_obj = lambda c, o: tools.run_async(config.cc, *cflags,
-                                                 '-c', '-o', o, c)
-        build_futs = [build_obj(c, o) for c, o in objects.items()]
-        await asyncio.gather(*build_futs)
-
-        binary = tools.create_tmp(suffix='.elf', dir=self.name)
         ldflags = config.ldflags + self.ldflags
 
         # setting connections (if not specified in JSON file)
         if not any("--num-connections" in flag for flag in ldflags):
             ldflags.append("--num-connections {}".format(self.connections))
 
-        await tools.run_async(config.ld, *ldflags,
-                              '-o', binary, *objects.values())
+        sources = [str(p) for p in self.files]
+        object_keys = await asyncio.gather(
+            *[self.__get_object_key(config, cflags, c) for c in sources])
+
+        key = await buildcache.make_key("sancus", {
+                "ld": config.ld,
+                "ldflags": ldflags,
+                "objects": object_keys
+            })
+        binary = os.path.join(glob.get_build_dir(), self.name,
+                              "{}.elf".format(key))
+
+        if await tools.run_blocking(os.path.exists, binary):
+            logging.info('Module %s is up to date', self.name)
+            return binary
+
+        cache = glob.get_build_cache()
+        if cache is not None and \
+                await cache.fetch(key, {"binary": binary}) is not None:
+            logging.info('Using cached build of module %s', self.name)
+            return binary
+
+        obj_dir = os.path.join(glob.get_build_dir(), OBJECTS_DIR)
+        await tools.run_blocking(os.makedirs, obj_dir, exist_ok=True)
+        objects = {c: os.path.join(obj_dir, "{}.o".format(k))
+                        for c, k in zip(sources, object_keys)}
+
+        # objects are written to a temporary file and renamed, so that an
+        # interrupted build never leaves a broken object (or binary) behind
+        async def build_obj(c, o):
+            if await tools.run_blocking(os.path.exists, o):
+                return
+
+            tmp = await tools.create_tmp_async(suffix='.o', dir=OBJECTS_DIR)
+            async with glob.build_slot():
+                await tools.run_async(config.cc, *cflags, '-c', '-o', tmp, c)
+            await tools.run_blocking(os.replace, tmp, o)
+
+        build_futs = [build_obj(c, o) for c, o in objects.items()]
+        await asyncio.gather(*build_futs)
+
+        logging.info('Linking module %s from %s',
+                     self.name, ', '.join(sources))
+
+        tmp = await tools.create_tmp_async(suffix='.elf', dir=self.name)
+        async with glob.build_slot():
+            await tools.run_async(config.ld, *ldflags,
+                                  '-o', tmp, *objects.values())
+        await tools.run_blocking(os.replace, tmp, binary)
+
+        if cache is not None:
+            await cache.store(key, {"binary": binary})
+
         return binary
 
 
+    # The key of an object includes the local headers included by its source
+    async def __get_object_key(self, config, cflags, source):
+        headers = await tools.run_blocking(_find_headers, [source],
+                                           _get_include_dirs(cflags))
+
+        return await buildcache.make_key("sancus-object", {
+                "toolchain": await buildcache.toolchain_version(config.cc),
+                "cc": config.cc,
+                "cflags": cflags
+            }, files=[source] + headers)
+
+
+    # The key of the module is computed as soon as it is deployed, while it is
+    # being attested (or other modules are deployed), instead of when it is
+    # first needed. Errors are raised when the key is awaited
+    async def __deploy(self):
+        result = await self.node.deploy(self)
+
+        if self.__key_fut is None:
+            self.__key_fut = asyncio.ensure_future(self._calculate_key())
+            self.__key_fut.add_done_callback(
+                    lambda fut: fut.cancelled() or fut.exception())
+
+        return result
 
+
+    # Module keys are stored in the build dir of the module, identified by a
+    # hash of the binary, the symtab returned by the node, the name of the
+    # module and the vendor key: they are computed only once, even across
+    # different commands. They are never stored in the build cache, which
+    # might be shared.
     async def _calculate_key(self):
         try:
             import sancus.crypto
         except:
             raise Error("Sancus python libraries not found in PYTHONPATH")
 
-        linked_binary = await self.__link()
+        link_key = await self.__get_link_key()
+        key_id = await buildcache.make_key("sancus-key", {
+                "link": link_key,
+                "name": self.name,
+                "vendor_key": binascii.hexlify(self.node.vendor_key).decode()
+            })
+        key_file = os.path.join(glob.get_build_dir(), self.name,
+                                "{}.key".format(key_id))
+
+        key = await tools.run_blocking(_read_key, key_file)
+        if key is None:
+            linked_binary = await self.__link()
+            key = await tools.run_blocking(_get_sm_key, linked_binary,
+                                           self.name, self.node.vendor_key)
+            await tools.run_blocking(_write_key, key_file, key)
 
-        with open(linked_binary, 'rb') as f:
-            key = sancus.crypto.get_sm_key(f, self.name, self.node.vendor_key)
-            logging.info('Module key for %s: %s',
-                         self.name, binascii.hexlify(key).decode('ascii'))
-            return key
+        logging.info('Module key for %s: %s',
+                     self.name, binascii.hexlify(key).decode('ascii'))
+        return key
 
 
+    async def __get_link_key(self):
+        return await buildcache.make_key("sancus-link", {
+                "ld": await buildcache.toolchain_version(LINKER)
+            }, files=[await self.symtab, await self.binary])
+
+
+    # The binary linked with the symtab is kept in the build dir of the module
+    # (see _calculate_key), and shared by all the users of the module key
     async def __link(self):
-        linked_binary = tools.create_tmp(suffix='.elf', dir=self.name)
+        if self.__link_fut is None:
+            self.__link_fut = asyncio.ensure_future(self.__do_link())
+
+        return await self.__link_fut
+
+
+    async def __do_link(self):
+        linked_binary = os.path.join(glob.get_build_dir(), self.name,
+                            "{}-linked.elf".format(await self.__get_link_key()))
+
+        if await tools.run_blocking(os.path.exists, linked_binary):
+            return linked_binary
+
+        tmp = await tools.create_tmp_async(suffix='.elf', dir=self.name)
 
         # NOTE: we use '--noinhibit-exec' flag because the linker complains
         #       if the addresses of .bss section are not aligned to 2 bytes
         #       using this flag instead, the output file is still generated
-        await tools.run_async('msp430-ld', '-T', await self.symtab,
-                      '-o', linked_binary, '--noinhibit-exec', await self.binary)
+        async with glob.build_slot():
+            await tools.run_async(LINKER, '-T', await self.symtab,
+                          '-o', tmp, '--noinhibit-exec', await self.binary)
+        await tools.run_blocking(os.replace, tmp, linked_binary)
         return linked_binary
 
 
     async def _get_io_id(self, io_name):
-        sym_name = '__sm_{}_io_{}_idx'.format(self.name, io_name)
-        symbol = await self.__get_symbol(sym_name)
+        symbols = await self.symbols
+        symbol = symbols["io"].get(io_name)
 
         if symbol is None:
             raise Error('Module {} has no endpoint named {}'
@@ -245,8 +384,8 @@ class SancusModule(Module):
 
 
     async def _get_entry_id(self, entry_name):
-        sym_name = '__sm_{}_entry_{}_idx'.format(self.name, entry_name)
-        symbol = await self.__get_symbol(sym_name)
+        symbols = await self.symbols
+        symbol = symbols["entry"].get(entry_name)
 
         if symbol is None:
             raise Error('Module {} has no entry named {}'
@@ -255,18 +394,123 @@ class SancusModule(Module):
         return symbol
 
 
-    async def __get_symbol(self, name):
-        if not await self.binary:
-            raise Error("ELF file not present for {}, cannot extract symbol ID of {}".format(self.name, name))
+    # The binary is parsed only once, and the symbols are then stored in the
+    # deployment descriptor together with the hash of the binary: later
+    # commands do not need to parse it again, unless it has been rebuilt
+    async def __get_symbols(self):
+        binary = await self.binary
+
+        if not binary:
+            raise Error("ELF file not present for {}, cannot extract symbol IDs".format(self.name))
+
+        return await tools.run_blocking(_get_symbols, binary, self.name,
+                                        self.__loaded_symbols)
+
+
+# Blocking, see tools.run_blocking. Returns the IDs of all the IOs and entry
+# points of the module, i.e., the values of its __sm_<name>_{io,entry}_<x>_idx
+# symbols, in a single pass over the symbol tables. `cached` (e.g., loaded from
+# the descriptor) is returned instead if it was extracted from the same binary
+def _get_symbols(binary, name, cached=None):
+    h = hashlib.sha256()
+    with open(binary, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    if isinstance(cached, dict) and cached.get("binary") == digest:
+        return cached
+
+    if cached is not None:
+        logging.debug("Binary of {} changed, extracting its symbols again"
+                        .format(name))
+
+    # only loaded if the binary needs to be parsed
+    from elftools.elf import elffile
+
+    symbol_re = re.compile(r'^__sm_{}_(io|entry)_(.+)_idx$'.format(
+                                re.escape(name)))
+    symbols = {"binary": digest, "io": {}, "entry": {}}
+
+    with open(binary, 'rb') as f:
+        elf = elffile.ELFFile(f)
+        for section in elf.iter_sections():
+            if isinstance(section, elffile.SymbolTableSection):
+                for symbol in section.iter_symbols():
+                    match = symbol_re.match(symbol.name)
+                    if match and symbol['st_shndx'] != 'SHN_UNDEF':
+                        kind, sym_name = match.groups()
+                        symbols[kind].setdefault(sym_name, symbol['st_value'])
+
+    return symbols
+
+
+# Blocking, see tools.run_blocking
+def _get_sm_key(linked_binary, name, vendor_key):
+    import sancus.crypto
+
+    with open(linked_binary, 'rb') as f:
+        return sancus.crypto.get_sm_key(f, name, vendor_key)
+
+
+# Blocking. Returns None if the key was not computed yet
+def _read_key(key_file):
+    try:
+        with open(key_file, 'rb') as f:
+            return f.read() or None
+    except FileNotFoundError:
+        return None
+
+
+# Blocking. The key is only readable by the user, and written to a temporary
+# file first, so that a concurrent reader never sees a partial key
+def _write_key(key_file, key):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(key_file))
+
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+
+    os.replace(tmp, key_file)
+
+
+def _get_include_dirs(cflags):
+    dirs = []
+
+    for i, flag in enumerate(cflags):
+        if flag == '-I' and i + 1 < len(cflags):
+            dirs.append(cflags[i + 1])
+        elif flag.startswith('-I'):
+            dirs.append(flag[2:])
+
+    return dirs
+
+
+# Local headers included by the sources, recursively. As the preprocessor
+# does, they are searched in the directory of the including file first, and
+# then in the include dirs. Headers not found are system headers
+def _find_headers(sources, include_dirs):
+    headers = []
+    visited = set(os.path.abspath(s) for s in sources)
+    stack = list(sources)
+
+    while stack:
+        path = stack.pop()
+
+        with open(path, 'r', errors='replace') as f:
+            includes = INCLUDE_RE.findall(f.read())
+
+        for include in includes:
+            for d in [os.path.dirname(path)] + include_dirs:
+                header = os.path.abspath(os.path.join(d, include))
+
+                if os.path.isfile(header):
+                    if header not in visited:
+                        visited.add(header)
+                        headers.append(header)
+                        stack.append(header)
+                    break
 
-        with open(await self.binary, 'rb') as f:
-            elf = elffile.ELFFile(f)
-            for section in elf.iter_sections():
-                if isinstance(section, elffile.SymbolTableSection):
-                    for symbol in section.iter_symbols():
-                        sym_section = symbol['st_shndx']
-                        if symbol.name == name and sym_section != 'SHN_UNDEF':
-                            return symbol['st_value']
+    return sorted(headers)
 
 
 _BuildConfig = namedtuple('_BuildConfig', ['cc', 'cflags', 'ld', 'ldflags'])
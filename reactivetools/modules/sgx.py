@@ -1,13 +1,15 @@
 import asyncio
 import logging
 import os
-import aiofile
 
 from .base import Module
 
-from ..nodes import SGXNode
+from ..nodes.sgx import SGXNode
 from .. import tools
 from .. import glob
+from .. import buildcache
+from .. import codegen
+from ..scheduler import node_resource
 from ..crypto import Encryption
 from ..dumpers import *
 from ..loaders import *
@@ -41,6 +43,10 @@ class SGXModule(Module):
         self.__build_fut = tools.init_future(binary)
         self.__convert_sign_fut = tools.init_future(sgxs, signature)
         self.__attest_fut = tools.init_future(key)
+        self.__cached_fut = None
+        # the build cache is not used if the generated code is already given
+        self.__cacheable = data is None
+        self.__cache_key = None
         self.__sp_keys_fut = asyncio.ensure_future(self.__generate_sp_keys())
 
         self.key = key
@@ -49,7 +55,7 @@ class SGXModule(Module):
         self.features = [] if features is None else features
         self.id = id if id is not None else node.get_module_id()
         self.port = port or self.node.reactive_port + self.id
-        self.output = os.path.join(glob.BUILD_DIR, name)
+        self.output = os.path.join(glob.get_build_dir(), name)
         self.folder = folder
 
 
@@ -181,6 +187,11 @@ class SGXModule(Module):
         await self.__attest_fut
 
 
+    def _get_attest_resources(self):
+        # remote attestation is done by an sgx-attester process
+        return ["attester", node_resource(self.node)]
+
+
     async def get_id(self):
         return self.id
 
@@ -294,14 +305,18 @@ class SGXModule(Module):
 
 
     async def __generate_code(self):
+        cached = await self.__get_cached()
+        if cached is not None:
+            return cached
+
         try:
-            import rustsgxgen
+            rustsgxgen = await codegen.import_generator()
         except:
             raise Error("rust-sgx-gen not installed! Check README.md")
 
         args = Object()
 
-        args.input = self.folder
+        args.input = glob.resolve_path(self.folder)
         args.output = self.output
         args.moduleid = self.id
         args.emport = self.node.deploy_port
@@ -309,26 +324,33 @@ class SGXModule(Module):
         args.spkey = await self.get_ra_sp_pub_key()
         args.print = None
 
-        data, _ = rustsgxgen.generate(args)
+        data, _ = await codegen.generate(args)
         logging.info("Generated code for module {}".format(self.name))
 
         return data
 
 
     async def __build(self):
-        await self.generate_code()
+        if await self.__get_cached() is not None:
+            return self.__get_binary_path()
+
+        data = await self.generate_code()
 
         release = "--release" if glob.get_build_mode() == glob.BuildMode.RELEASE else ""
         features = "--features " + " ".join(self.features) if self.features else ""
 
         cmd = BUILD_APP.format(release, features, self.output).split()
-        await tools.run_async(*cmd)
-
-        binary = os.path.join(self.output, "target", SGX_TARGET,
-                        glob.get_build_mode().to_str(), self.folder)
+        binary = self.__get_binary_path()
+        await tools.run_cargo_build(*cmd,
+                    manifest=os.path.join(self.output, "Cargo.toml"),
+                    triple=SGX_TARGET, name=self.folder, binary=binary, id=self.name)
 
         logging.info("Built module {}".format(self.name))
 
+        if self.__cache_key is not None:
+            await glob.get_build_cache().store(self.__cache_key,
+                                    {"binary": binary}, {"data": data})
+
         return binary
 
 
@@ -339,6 +361,23 @@ class SGXModule(Module):
         sgxs = "{}.sgxs".format(binary)
         sig = "{}.sig".format(binary)
 
+        # the signed enclave only depends on the binary, the vendor key and
+        # the debug flag
+        cache_key = None
+        if self.__cache_key is not None:
+            cache_key = await buildcache.make_key("sgx-sign", {
+                    "build": self.__cache_key,
+                    "convert": CONVERT_SGX,
+                    "sign": SIGN_SGX,
+                    "debug": debug
+                }, files=[self.vendor_key])
+
+            if await glob.get_build_cache().fetch(cache_key,
+                                    {"sgxs": sgxs, "sig": sig}) is not None:
+                logging.info("Using cached signature of module {}".format(
+                                self.name))
+                return sgxs, sig
+
         cmd_convert = CONVERT_SGX.format(binary, debug).split()
         cmd_sign = SIGN_SGX.format(self.vendor_key, sgxs, sig, debug).split()
 
@@ -347,9 +386,53 @@ class SGXModule(Module):
 
         logging.info("Converted & signed module {}".format(self.name))
 
+        if cache_key is not None:
+            await glob.get_build_cache().store(cache_key,
+                                               {"sgxs": sgxs, "sig": sig})
+
         return sgxs, sig
 
 
+    def __get_binary_path(self):
+        return os.path.join(self.output, "target", SGX_TARGET,
+                        glob.get_build_mode().to_str(), self.folder)
+
+
+    # Returns the generated data of the cached build of this module, after
+    # copying its binary to the build dir, or None if not cached
+    async def __get_cached(self):
+        if self.__cached_fut is None:
+            self.__cached_fut = asyncio.ensure_future(self.__fetch_cached())
+
+        return await self.__cached_fut
+
+
+    async def __fetch_cached(self):
+        cache = glob.get_build_cache()
+        if cache is None or not self.__cacheable:
+            return None
+
+        self.__cache_key = await buildcache.make_key("sgx", {
+                "toolchain": await buildcache.toolchain_version("cargo", "rustc"),
+                "codegen": buildcache.package_version("rust-sgx-gen"),
+                "target": SGX_TARGET,
+                "folder": self.folder,
+                "id": self.id,
+                "emport": self.node.deploy_port,
+                "features": self.features,
+                "mode": glob.get_build_mode().to_str()
+            }, files=[await self.get_ra_sp_pub_key()],
+               trees=[glob.resolve_path(self.folder)])
+
+        cached = await cache.fetch(self.__cache_key,
+                                   {"binary": self.__get_binary_path()})
+        if cached is None:
+            return None
+
+        logging.info("Using cached build of module {}".format(self.name))
+        return cached["data"]
+
+
     async def __attest(self):
         env = {}
         env["SP_PRIVKEY"] = await self.get_ra_sp_priv_key()
@@ -371,9 +454,9 @@ class SGXModule(Module):
 
     async def __generate_sp_keys(self):
         async with self.sp_lock:
-            priv = os.path.join(glob.BUILD_DIR, "private_key.pem")
-            pub = os.path.join(glob.BUILD_DIR, "public_key.pem")
-            ias_cert = os.path.join(glob.BUILD_DIR, "ias_root_ca.pem")
+            priv = os.path.join(glob.get_build_dir(), "private_key.pem")
+            pub = os.path.join(glob.get_build_dir(), "public_key.pem")
+            ias_cert = os.path.join(glob.get_build_dir(), "ias_root_ca.pem")
 
             # check if already generated in a previous run
             if all(map(lambda x : os.path.exists(x), [priv, pub, ias_cert])):
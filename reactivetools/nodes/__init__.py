@@ -1,7 +1,7 @@
+import importlib
+import sys
+
 from .base import Node
-from .sancus import SancusNode
-from .native import NativeNode
-from .sgx import SGXNode
 
 node_rules = {
     "sancus"    : "sancus.yaml",
@@ -9,14 +9,21 @@ node_rules = {
     "native"    : "native.yaml"
 }
 
-node_funcs = {
-    "sancus"    : SancusNode.load,
-    "sgx"       : SGXNode.load,
-    "native"    : NativeNode.load
+# Node classes are imported only when a node of that type is actually used,
+# to avoid loading the dependencies of all the architectures at startup
+node_classes = {
+    "sancus"    : ("sancus", "SancusNode"),
+    "sgx"       : ("sgx", "SGXNode"),
+    "native"    : ("native", "NativeNode")
 }
 
-node_cleanup_coros = [
-    SancusNode.cleanup,
-    SGXNode.cleanup,
-    NativeNode.cleanup
-]
+
+def get_node_class(type):
+    module, cls = node_classes[type]
+    return getattr(importlib.import_module("." + module, __name__), cls)
+
+
+def get_node_cleanup_coros():
+    # Classes that have not been imported have nothing to clean up
+    return [get_node_class(type).cleanup for type, (module, _) in node_classes.items()
+                if "{}.{}".format(__name__, module) in sys.modules]
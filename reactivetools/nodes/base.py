@@ -8,6 +8,7 @@ from enum import IntEnum
 from reactivenet import *
 
 from .. import tools
+from .. import glob
 
 class Error(Exception):
     pass
@@ -36,6 +37,27 @@ class Node(ABC):
         else:
             self.__lock = None
 
+        self.__semaphore = None
+
+
+    @property
+    def need_lock(self):
+        return self.__lock is not None
+
+
+    """
+    ### Description ###
+    Set the maximum number of reactive commands sent concurrently to the node
+
+    ### Parameters ###
+    self: Node object
+    limit (int): maximum number of commands (None: no limit)
+
+    ### Returns ###
+    """
+    def set_concurrency(self, limit):
+        self.__semaphore = None if limit is None else asyncio.Semaphore(limit)
+
 
 
     """
@@ -186,6 +208,7 @@ class Node(ABC):
     arg (bytes): argument to pass as a byte array (can be None)
 
     ### Returns ###
+    `bytes`: payload of the response (None if the call failed)
     """
     async def call(self, module, entry, arg=None):
         assert module.node is self
@@ -210,9 +233,11 @@ class Node(ABC):
 
         if not response.ok():
             logging.error("Received error code {}".format(str(response.code)))
-        else:
-            logging.info("Response: \"{}\"".format(
-                binascii.hexlify(response.message.payload).decode('ascii')))
+            return None
+
+        logging.info("Response: \"{}\"".format(
+            binascii.hexlify(response.message.payload).decode('ascii')))
+        return bytes(response.message.payload)
 
 
     """
@@ -223,50 +248,80 @@ class Node(ABC):
     self: Node object
     connection (Connection): connection object
     arg (bytes): argument to pass as a byte array (can be None)
+    nonce (int): nonce to use (if None, connection.nonce is used)
 
     ### Returns ###
     """
-    async def output(self, connection, arg=None):
-        assert connection.to_module.node is self
+    async def output(self, connection, arg=None, nonce=None):
+        if nonce is None:
+            nonce = connection.nonce
 
-        module_id = await connection.to_module.get_id()
+        command = await self.make_direct_command(
+                    ReactiveCommand.RemoteOutput, connection, arg, nonce)
 
-        if arg is None:
-            data = b''
-        else:
-            data = arg
+        await self._send_reactive_command(
+                command,
+                log='Sending handle_output command of connection {}:{} to {} on {}'.format(
+                     connection.id, connection.name, connection.to_module.name, self.name)
+                )
 
-        cipher = await connection.encryption.encrypt(connection.key,
-                    tools.pack_int16(connection.nonce), data)
 
-        payload = tools.pack_int16(module_id)               + \
-                  tools.pack_int16(connection.id)           + \
-                  cipher
+    """
+    ### Description ###
+    Coroutine. Trigger the 'request' event of a direct connection
 
-        command = CommandMessage(ReactiveCommand.RemoteOutput,
-                                Message(payload),
-                                self.ip_address,
-                                self.reactive_port)
+    The request uses `nonce`, the response `nonce + 1`
 
-        await self._send_reactive_command(
+    ### Parameters ###
+    self: Node object
+    connection (Connection): connection object
+    arg (bytes): argument to pass as a byte array (can be None)
+    nonce (int): nonce to use (if None, connection.nonce is used)
+
+    ### Returns ###
+    `bytes`: decrypted response (None if the request failed)
+    """
+    async def request(self, connection, arg=None, nonce=None):
+        if nonce is None:
+            nonce = connection.nonce
+
+        command = await self.make_direct_command(
+                    ReactiveCommand.RemoteRequest, connection, arg, nonce)
+
+        response = await self._send_reactive_command(
                 command,
-                log='Sending handle_output command of connection {}:{} to {} on {}'.format(
+                log='Sending handle_request command of connection {}:{} to {} on {}'.format(
                      connection.id, connection.name, connection.to_module.name, self.name)
                 )
 
+        if not response.ok():
+            logging.error("Received error code {}".format(str(response.code)))
+            return None
+
+        plaintext = await self.decrypt_response(connection, response, nonce)
+
+        logging.info("Response: \"{}\"".format(
+            binascii.hexlify(plaintext).decode('ascii')))
+        return plaintext
+
+
 
     """
     ### Description ###
-    Coroutine. Trigger the 'request' event of a direct connection
+    Coroutine. Build the encrypted command of an output or a request event of
+    a direct connection, without sending it
 
     ### Parameters ###
     self: Node object
+    code (ReactiveCommand): RemoteOutput or RemoteRequest
     connection (Connection): connection object
     arg (bytes): argument to pass as a byte array (can be None)
+    nonce (int): nonce to use
 
     ### Returns ###
+    `CommandMessage`: the command, to send with _send_reactive_command
     """
-    async def request(self, connection, arg=None):
+    async def make_direct_command(self, code, connection, arg, nonce):
         assert connection.to_module.node is self
 
         module_id = await connection.to_module.get_id()
@@ -277,33 +332,35 @@ class Node(ABC):
             data = arg
 
         cipher = await connection.encryption.encrypt(connection.key,
-                    tools.pack_int16(connection.nonce), data)
+                    tools.pack_int16(nonce), data)
 
         payload = tools.pack_int16(module_id)               + \
                   tools.pack_int16(connection.id)           + \
                   cipher
 
-        command = CommandMessage(ReactiveCommand.RemoteRequest,
-                                Message(payload),
-                                self.ip_address,
-                                self.reactive_port)
+        return CommandMessage(code,
+                              Message(payload),
+                              self.ip_address,
+                              self.reactive_port)
 
-        response = await self._send_reactive_command(
-                command,
-                log='Sending handle_request command of connection {}:{} to {} on {}'.format(
-                     connection.id, connection.name, connection.to_module.name, self.name)
-                )
 
-        if not response.ok():
-            logging.error("Received error code {}".format(str(response.code)))
-            return
 
-        resp_encrypted = response.message.payload
-        plaintext = await connection.encryption.decrypt(connection.key,
-                    tools.pack_int16(connection.nonce + 1), resp_encrypted)
+    """
+    ### Description ###
+    Coroutine. Decrypt the response to a request sent with `nonce`
 
-        logging.info("Response: \"{}\"".format(
-            binascii.hexlify(plaintext).decode('ascii')))
+    ### Parameters ###
+    self: Node object
+    connection (Connection): connection object
+    response (ResultMessage): response of the node
+    nonce (int): nonce used for the request
+
+    ### Returns ###
+    `bytes`: decrypted response
+    """
+    async def decrypt_response(self, connection, response, nonce):
+        return await connection.encryption.decrypt(connection.key,
+                    tools.pack_int16(nonce + 1), response.message.payload)
 
 
 
@@ -352,6 +409,14 @@ class Node(ABC):
     ### Returns ###
     """
     async def _send_reactive_command(self, command, log=None):
+        if self.__semaphore is not None:
+            async with self.__semaphore:
+                return await self.__send_locked(command, log)
+        else:
+            return await self.__send_locked(command, log)
+
+
+    async def __send_locked(self, command, log):
         if self.__lock is not None:
             async with self.__lock:
                 return await self.__send_reactive_command(command, log)
@@ -377,13 +442,24 @@ class Node(ABC):
         if log is not None:
             logging.info(log)
 
+        # commands are sent over a persistent connection, if enabled (see
+        # connpool.py), otherwise over a new connection each
+        pool = glob.get_connection_pool()
+
         if command.has_response():
-            response =  await command.send_wait()
+            if pool is not None:
+                response = await pool.send(command)
+            else:
+                response = await command.send_wait()
+
             if not response.ok():
                 raise Error('Reactive command {} failed with code {}'
                                 .format(str(command.code), str(response.code)))
             return response
 
         else:
-            await command.send()
+            if pool is not None:
+                await pool.send(command)
+            else:
+                await command.send()
             return None
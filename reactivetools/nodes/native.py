@@ -1,5 +1,4 @@
 import asyncio
-import aiofile
 import ipaddress
 
 from reactivenet import CommandMessageLoad
@@ -39,6 +38,8 @@ class NativeNode(SGXBase):
         if module.deployed:
             return
 
+        import aiofile
+
         async with aiofile.AIOFile(await module.binary, "rb") as f:
             binary = await f.read()
 
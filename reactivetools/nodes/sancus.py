@@ -1,7 +1,6 @@
 import asyncio
 import logging
 import binascii
-import aiofile
 import ipaddress
 from enum import IntEnum
 
@@ -64,6 +63,8 @@ class SancusNode(Node):
         if module.deployed:
             return
 
+        import aiofile
+
         async with aiofile.AIOFile(await module.binary, "rb") as f:
             file_data = await f.read()
 
@@ -89,12 +90,8 @@ class SancusNode(Node):
                             .format(module.name, self.name))
 
         symtab = res.message.payload[2:]
-        symtab_file = tools.create_tmp(suffix='.ld', dir=module.name)
-
-        # aiofile for write operations is bugged (version 3.3.3)
-        # I get a "bad file descriptor" error after writes.
-        with open(symtab_file, "wb") as f:
-            f.write(symtab[:-1]) # Drop last 0 byte
+        symtab_file = await tools.run_blocking(_write_symtab, module.name,
+                                               symtab[:-1]) # Drop last 0 byte
 
         module.deployed = True
         return sm_id, symtab_file
@@ -193,3 +190,14 @@ class SancusNode(Node):
         await self._send_reactive_command(
                 command,
                 log='Connecting id {} to {}'.format(conn_id, to_module.name))
+
+
+# aiofile for write operations is bugged (version 3.3.3): the symtab is
+# written in the pool of blocking work instead (see tools.run_blocking)
+def _write_symtab(module_name, symtab):
+    symtab_file = tools.create_tmp(suffix='.ld', dir=module_name)
+
+    with open(symtab_file, "wb") as f:
+        f.write(symtab)
+
+    return symtab_file
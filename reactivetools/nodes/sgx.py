@@ -1,5 +1,4 @@
 import asyncio
-import aiofile
 import logging
 from abc import ABC, abstractmethod
 import binascii
@@ -107,6 +106,8 @@ class SGXNode(SGXBase):
         if module.deployed:
             return
 
+        import aiofile
+
         async with aiofile.AIOFile(await module.sgxs, "rb") as f:
             sgxs = await f.read()
 
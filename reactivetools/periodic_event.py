@@ -1,6 +1,8 @@
 import asyncio
 import logging
 
+from .scheduler import node_resource
+
 class PeriodicEvent:
     def __init__(self, name, id, module, entry, frequency, established):
         self.name = name
@@ -39,6 +41,17 @@ class PeriodicEvent:
             }
 
 
+    # Add the task to register the event to a Scheduler, if needed
+    def emit_tasks(self, scheduler):
+        if self.established:
+            return
+
+        scheduler.add("register:{}".format(self.name), self.register,
+                      deps=[scheduler.get("attest:{}".format(self.module.name))],
+                      resources=[node_resource(self.module.node)],
+                      entities=[self])
+
+
     async def register(self):
         if self.established:
             return
@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import urllib.error
+import urllib.request
+
+from . import tools
+
+# Remote backend of the build cache (see buildcache.py), shared e.g. by CI
+# workers and operators, over a simple HTTP protocol:
+#
+#   GET  /objects/<sha256>  -> content of an artifact
+#   PUT  /objects/<sha256>  <- content of an artifact
+#   GET  /entries/<key>     -> {"files": {<name>: <sha256>}, "data": <data>}
+#   PUT  /entries/<key>     <- same as above
+#
+# Artifacts are content-addressed: the server rejects objects whose content
+# does not match their hash, and entries referencing missing objects. Entries
+# are write-once: the server rejects entries that already exist (409), e.g.,
+# uploaded concurrently by another client. The client checks the hash of each
+# object it downloads, and treats any error as a miss, so that the module is
+# built locally.
+#
+# cacheserver.py is a reference implementation of the server, storing objects
+# and entries in a directory (`reactive-tools cache-server <dir>`).
+
+OBJECT_RE = re.compile(r'^[0-9a-f]{64}$')
+KEY_RE = re.compile(r'^[0-9A-Za-z_-]+$')
+NAME_RE = re.compile(r'^[0-9A-Za-z_.-]+$')
+CHUNK_SIZE = 1 << 16
+
+
+class Error(Exception):
+    pass
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _write_file(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+class HTTPCache:
+    def __init__(self, url, max_connections=8, timeout=30):
+        """
+        url: base URL of the server, e.g., http://cache.local:8100
+        max_connections: maximum number of concurrent requests
+        timeout: timeout of each request, in seconds
+        """
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.__semaphore = asyncio.Semaphore(max_connections)
+
+
+    async def download(self, key, dir):
+        """
+        Downloads the artifacts of the entry `key` to `dir`, concurrently, and
+        returns the entry as a dict, or None if not found
+        """
+        try:
+            entry = await self.__request("GET", "/entries/" + key)
+            if entry is None:
+                return None
+
+            entry = json.loads(entry)
+            await asyncio.gather(*[
+                self.__download_object(digest, os.path.join(dir, name))
+                    for name, digest in entry["files"].items()])
+        except (Error, OSError, ValueError, KeyError, AttributeError) as e:
+            logging.warning("Failed to download {} from the remote build " \
+                            "cache: {}".format(key, e))
+            return None
+
+        logging.debug("Remote build cache hit: {}".format(key))
+        return entry
+
+
+    async def upload(self, key, artifacts, data):
+        """
+        Uploads the artifacts (dict of artifact name -> path) and `data` to
+        the entry `key`. Failures are only logged
+        """
+        try:
+            digests = await asyncio.gather(*[
+                tools.run_blocking(_hash_file, path)
+                    for path in artifacts.values()])
+
+            await asyncio.gather(*[self.__upload_object(digest, path)
+                        for digest, path in zip(digests, artifacts.values())])
+
+            entry = {"files": dict(zip(artifacts, digests)), "data": data}
+            await self.__request("PUT", "/entries/" + key,
+                                 json.dumps(entry).encode())
+        except (Error, OSError) as e:
+            logging.warning("Failed to upload {} to the remote build " \
+                            "cache: {}".format(key, e))
+            return
+
+        logging.debug("Remote build cache store: {}".format(key))
+
+
+    async def __download_object(self, digest, dest):
+        if not OBJECT_RE.match(digest):
+            raise Error("Bad object: {}".format(digest))
+        # the name of the artifact must not escape its directory
+        if not NAME_RE.match(os.path.basename(dest)) or \
+                os.path.basename(dest).startswith('.'):
+            raise Error("Bad artifact name: {}".format(os.path.basename(dest)))
+
+        content = await self.__request("GET", "/objects/" + digest)
+        if content is None:
+            raise Error("Object {} not found".format(digest))
+
+        if hashlib.sha256(content).hexdigest() != digest:
+            raise Error("Object {} is corrupted".format(digest))
+
+        await tools.run_blocking(_write_file, dest, content)
+
+
+    async def __upload_object(self, digest, path):
+        content = await tools.run_blocking(_read_file, path)
+
+        await self.__request("PUT", "/objects/" + digest, content)
+
+
+    # Returns the body of the response, or None if not found. Requests are
+    # made by urllib in the pool of blocking work
+    async def __request(self, method, path, body=None):
+        request = urllib.request.Request(self.url + path, data=body,
+                                         method=method)
+
+        def send():
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as r:
+                    return r.read()
+            except urllib.error.HTTPError as e:
+                if e.code == 404:
+                    return None
+                # entries are write-once: already uploaded by another client
+                if e.code == 409 and method == "PUT":
+                    return None
+                raise Error("{} {}: HTTP {}".format(method, path, e.code))
+            except urllib.error.URLError as e:
+                raise Error("{} {}: {}".format(method, path, e.reason))
+
+        async with self.__semaphore:
+            return await tools.run_blocking(send)
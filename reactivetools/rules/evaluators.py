@@ -1,9 +1,11 @@
-import yaml
 import os
 import logging
 
 from ..descriptor import DescriptorType
 
+# rules file -> list of (rule, code object), filled by compile_rules
+__compiled_rules = {}
+
 def is_present(dict, key):
     return key in dict and dict[key] is not None
 
@@ -42,3 +44,42 @@ def load_rules(file):
         logging.warning("Something went wrong during load of {}".format(file))
         logging.debug(e)
         return {}
+
+
+# Parse the rules of `file` and compile each of them into a code object.
+# This is done only once per process: the result is cached and reused for
+# every entity of the deployment descriptor.
+def compile_rules(file):
+    if file in __compiled_rules:
+        return __compiled_rules[file]
+
+    compiled = []
+    for rule, expr in load_rules(file).items():
+        try:
+            code = compile(str(expr), file, 'eval')
+        except SyntaxError as e:
+            logging.warning("{} - Cannot compile rule: {}".format(file, rule))
+            logging.debug(e)
+            code = None
+
+        compiled.append((rule, code))
+
+    __compiled_rules[file] = compiled
+    return compiled
+
+
+# Evaluate all the rules of `file` against `dict`
+# returns the list of broken rules (empty if all the rules are satisfied)
+def check_rules(file, dict):
+    broken = []
+
+    for rule, code in compile_rules(file):
+        try:
+            result = code is not None and eval(code, globals(), {"dict": dict})
+        except:
+            result = False
+
+        if not result:
+            broken.append(rule)
+
+    return broken
@@ -0,0 +1,251 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+
+# Task graph of the deployment work
+#
+# Each task wraps a coroutine function (e.g., module.build) and declares:
+#   - the tasks it depends on, which must complete successfully before it starts
+#   - the resources it uses while running, e.g., "build" for the CPU-bound
+#     builds, "node:<name>" for the sockets of a node, "attester" for the
+#     attester processes. Each resource may have a limit on the number of tasks
+#     using it concurrently
+#   - a priority: when a resource is contended, tasks with a lower priority
+#     value get it first; tasks without priority (None) get it last
+#
+# Entities (modules, connections, ...) emit their own tasks with `emit_tasks`,
+# and the whole graph can be inspected with `format_plan` before running it.
+
+
+class Error(Exception):
+    pass
+
+
+def node_resource(node):
+    return "node:{}".format(node.name)
+
+
+# Default limits, derived from the number of CPUs: builds and attester processes
+# are CPU-bound, while commands to nodes mostly wait for the network
+def default_limits():
+    cpus = os.cpu_count() or 1
+
+    return {
+        "build": cpus,
+        "attester": cpus,
+        "node": 2 * cpus
+    }
+
+
+# The limit of a resource is either its own (e.g., "node:node1"), or the one of
+# its kind (e.g., "node"). None means no limit
+def get_limit(limits, resource):
+    kind = resource.split(":")[0]
+    return limits.get(resource, limits.get(kind))
+
+
+class Task:
+    def __init__(self, name, func, deps, resources, priority, entities):
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.resources = resources
+        self.priority = priority
+        self.entities = entities
+
+
+    def add_dependency(self, task):
+        if task is not None and task not in self.deps:
+            self.deps.append(task)
+
+
+    def __str__(self):
+        s = self.name
+
+        if self.resources:
+            s += " [{}]".format(", ".join(self.resources))
+        if self.priority is not None:
+            s += " (priority {})".format(self.priority)
+        if self.deps:
+            s += " <- {}".format(", ".join(dep.name for dep in self.deps))
+
+        return s
+
+
+class Resource:
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.used = 0
+        self.__waiters = []
+        self.__counter = itertools.count()
+
+
+    async def acquire(self, priority):
+        if self.limit is None:
+            return
+
+        if self.used < self.limit and not self.__waiters:
+            self.used += 1
+            return
+
+        fut = asyncio.get_event_loop().create_future()
+        key = (priority is None, priority or 0, next(self.__counter))
+        heapq.heappush(self.__waiters, (key, fut))
+
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # the slot might have been handed over right before cancelling
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+
+    def release(self):
+        if self.limit is None:
+            return
+
+        # the slot is handed over to the first waiter, if any
+        while self.__waiters:
+            _, fut = heapq.heappop(self.__waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+
+        self.used -= 1
+
+
+class Scheduler:
+    def __init__(self, limits=None):
+        """
+        limits: dict of resource -> maximum number of concurrent tasks. A
+                limit can be given for a single resource (e.g., "node:node1")
+                or for all the resources of a kind (e.g., "node"). Resources
+                without limit are not bounded
+        """
+        self.limits = limits or {}
+        self.__tasks = {}
+        self.__resources = {}
+
+
+    @property
+    def tasks(self):
+        return list(self.__tasks.values())
+
+
+    def add(self, name, func, deps=(), resources=(), priority=None,
+            entities=()):
+        """
+        Add a task, which runs `await func()`. `deps` can contain None
+        values (i.e., tasks not emitted), which are ignored. `entities` are
+        the entities whose state is changed by the task.
+        """
+        if name in self.__tasks:
+            raise Error("Task {} already exists".format(name))
+
+        task = Task(name, func, [d for d in deps if d is not None],
+                    sorted(set(resources)), priority, list(entities))
+        self.__tasks[name] = task
+        return task
+
+
+    def get(self, name):
+        return self.__tasks.get(name)
+
+
+    def get_resource(self, name):
+        if name not in self.__resources:
+            self.__resources[name] = Resource(name, get_limit(self.limits, name))
+
+        return self.__resources[name]
+
+
+    def select(self, predicate):
+        """
+        Returns a new Scheduler with only the tasks for which predicate(task)
+        is True. Dependencies on the other tasks are dropped
+        """
+        scheduler = Scheduler(self.limits)
+
+        for task in self.plan():
+            if predicate(task):
+                scheduler.add(task.name, task.func,
+                              [scheduler.get(dep.name) for dep in task.deps],
+                              task.resources, task.priority, task.entities)
+
+        return scheduler
+
+
+    def plan(self):
+        """
+        Returns the tasks in topological order, i.e., each task after all its
+        dependencies
+        """
+        order = []
+        state = {}
+
+        def visit(task, path):
+            if state.get(task) == "done":
+                return
+            if state.get(task) == "visiting":
+                raise Error("Dependency cycle: {}".format(
+                            " -> ".join(t.name for t in path + [task])))
+
+            state[task] = "visiting"
+            for dep in task.deps:
+                visit(dep, path + [task])
+
+            state[task] = "done"
+            order.append(task)
+
+        for task in self.__tasks.values():
+            visit(task, [])
+
+        return order
+
+
+    def format_plan(self):
+        return "\n".join(str(task) for task in self.plan())
+
+
+    async def run(self, on_done=lambda task: None):
+        """
+        Run all the tasks, calling on_done(task) after each successful one.
+        If a task fails, the tasks depending on it fail with the same error,
+        while the others are completed anyway. The first error is raised at
+        the end.
+        """
+        futures = {}
+
+        async def run_task(task):
+            await asyncio.gather(*[futures[dep] for dep in task.deps])
+
+            resources = [self.get_resource(r) for r in task.resources]
+            acquired = []
+
+            # resources are always acquired in the same (sorted) order, to
+            # prevent deadlocks
+            try:
+                for resource in resources:
+                    await resource.acquire(task.priority)
+                    acquired.append(resource)
+
+                logging.debug("Starting task {}".format(task.name))
+                await task.func()
+            finally:
+                for resource in reversed(acquired):
+                    resource.release()
+
+            on_done(task)
+
+        for task in self.plan():
+            futures[task] = asyncio.ensure_future(run_task(task))
+
+        results = await asyncio.gather(*futures.values(), return_exceptions=True)
+
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            raise errors[0]
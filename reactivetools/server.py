@@ -0,0 +1,226 @@
+import asyncio
+import binascii
+import json
+import logging
+import os
+import signal
+import socket
+
+from . import config
+from . import tools
+
+# The server keeps a configuration loaded in memory, and accepts commands over
+# a UNIX domain socket. Requests and responses are JSON objects, one per line:
+#
+#   {"command": "call", "module": <name>, "entry": <entry>, "arg": <hex>}
+#   {"command": "output", "connection": <name or ID>, "arg": <hex>}
+#   {"command": "request", "connection": <name or ID>, "arg": <hex>}
+#
+#   -> {"ok": true, "response": <hex or null>}
+#   -> {"ok": false, "error": <message>}
+#
+# State changes (e.g., nonces) are appended to the journal of the deployment
+# descriptor in background, every `flush_interval` seconds.
+
+
+class Error(Exception):
+    pass
+
+
+class Server:
+    def __init__(self, conf, socket_path, flush_interval=1.0):
+        self.config = conf
+        self.socket_path = socket_path
+        self.flush_interval = flush_interval
+        self.requests = 0
+
+        # entities to persist, in insertion order
+        self.__dirty = {}
+        # connection -> lock, to send the events of a connection in order
+        self.__conn_locks = {}
+        self.__flush_lock = asyncio.Lock()
+
+
+    async def serve(self):
+        await self.__remove_stale_socket()
+
+        server = await asyncio.start_unix_server(self.__handle_client,
+                                                 path=self.socket_path)
+        flusher = asyncio.ensure_future(self.__flush_loop())
+
+        stop = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        logging.info("Listening on {}".format(self.socket_path))
+
+        try:
+            await stop.wait()
+        finally:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+
+            server.close()
+            await server.wait_closed()
+            flusher.cancel()
+            await self.flush()
+            os.remove(self.socket_path)
+
+        logging.info("Server stopped after {} requests".format(self.requests))
+
+
+    # A socket left by a server that did not stop cleanly is removed, but the
+    # one of a running server is not: two servers would journal and dump the
+    # same descriptor, overwriting each other's changes
+    async def __remove_stale_socket(self):
+        try:
+            _, writer = await asyncio.open_unix_connection(self.socket_path)
+        except FileNotFoundError:
+            return
+        except ConnectionRefusedError:
+            os.remove(self.socket_path)
+            return
+
+        writer.close()
+        raise Error("Another server is already listening on {}".format(
+                        self.socket_path))
+
+
+    async def flush(self):
+        async with self.__flush_lock:
+            if not self.__dirty:
+                return
+
+            entities = list(self.__dirty)
+            self.__dirty.clear()
+
+            # entities dumped here only contain plain values (no coroutines)
+            await tools.run_blocking(config.journal_config, self.config,
+                                     entities)
+
+
+    async def execute(self, request):
+        command = request.get('command')
+        arg = parse_arg(request.get('arg'))
+
+        if command == 'call':
+            module = self.config.get_module(request['module'])
+            return await module.call(request['entry'], arg)
+
+        if command == 'output':
+            conn = self.__get_direct_connection(request['connection'])
+            if not conn.to_input:
+                raise Error("Not a output-input connection")
+
+            async with self.__get_lock(conn):
+                await conn.to_module.node.output(conn, arg)
+                conn.nonce += 1
+
+            self.__dirty[conn] = None
+            return None
+
+        if command == 'request':
+            conn = self.__get_direct_connection(request['connection'])
+            if not conn.to_handler:
+                raise Error("Not a request-handler connection")
+
+            async with self.__get_lock(conn):
+                response = await conn.to_module.node.request(conn, arg)
+                conn.nonce += 2
+
+            self.__dirty[conn] = None
+            return response
+
+        raise Error("Unknown command: {}".format(command))
+
+
+    async def __handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                self.requests += 1
+
+                try:
+                    response = await self.execute(json.loads(line))
+                    result = {"ok": True, "response": dump_arg(response)}
+                except Exception as e:
+                    logging.error(e)
+                    result = {"ok": False, "error": str(e)}
+
+                writer.write(_encode(result))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+    async def __flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+
+            try:
+                # a flush is never interrupted halfway, even if the loop is cancelled
+                await asyncio.shield(self.flush())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("Failed to persist state: {}".format(e))
+
+
+    def __get_direct_connection(self, name):
+        conn = self.config.get_connection(str(name))
+
+        if not conn.direct:
+            raise Error("Connection is not direct.")
+
+        return conn
+
+
+    def __get_lock(self, conn):
+        if conn not in self.__conn_locks:
+            self.__conn_locks[conn] = asyncio.Lock()
+
+        return self.__conn_locks[conn]
+
+
+def get_default_socket(config_file):
+    return "{}.sock".format(os.path.abspath(config_file))
+
+
+# Client side: send a request to a running server, and return its response
+def send_request(socket_path, request):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(socket_path)
+        except OSError as e:
+            raise Error("Cannot connect to server at {}: {}".format(socket_path, e))
+
+        s.sendall(_encode(request))
+        with s.makefile('rb') as f:
+            line = f.readline()
+
+    if not line:
+        raise Error("Connection closed by the server")
+
+    result = json.loads(line)
+    if not result["ok"]:
+        raise Error(result["error"])
+
+    return parse_arg(result["response"])
+
+
+def parse_arg(arg):
+    return None if arg is None else binascii.unhexlify(arg)
+
+
+def dump_arg(arg):
+    return None if arg is None else binascii.hexlify(arg).decode('ascii')
+
+
+def _encode(obj):
+    return (json.dumps(obj) + "\n").encode()
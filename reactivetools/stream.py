@@ -0,0 +1,180 @@
+import asyncio
+import binascii
+import logging
+import time
+
+from reactivenet import ReactiveCommand
+
+from . import tools
+
+# Streaming of output/request events on a direct connection
+#
+# The payloads are encrypted by a producer while a consumer sends them to the
+# node, in order. The nonces of the whole stream are taken from the connection
+# upfront: the i-th event uses `connection.nonce + i * step`, where step is 1
+# for outputs and 2 for requests (the response uses nonce + 1).
+# `connection.nonce` is advanced after each event is sent, so that it never
+# skips a nonce even if the stream is interrupted halfway: the caller only
+# needs to persist the connection once, at the end.
+
+MAX_NONCE = 0xffff
+
+
+class Error(Exception):
+    pass
+
+
+class Stats:
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.elapsed = 0
+        self.latencies = []
+
+
+    def add(self, size, latency):
+        self.count += 1
+        self.bytes += size
+        self.latencies.append(latency)
+
+
+    def to_dict(self):
+        latencies = sorted(self.latencies)
+        elapsed = self.elapsed or float('inf')
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        return {
+            "count": self.count,
+            "bytes": self.bytes,
+            "elapsed_s": self.elapsed,
+            "events_per_s": self.count / elapsed,
+            "bytes_per_s": self.bytes / elapsed,
+            "latency_ms": {
+                "mean": sum(latencies) / len(latencies) * 1000 if latencies else None,
+                "p50": percentile(0.5),
+                "p99": percentile(0.99),
+                "max": latencies[-1] * 1000 if latencies else None
+            }
+        }
+
+
+async def stream(connection, payloads, rate=None, window=32, on_response=None):
+    """
+    Send each payload of `payloads` (an iterable or an async iterable of bytes)
+    through `connection`, a direct connection to an input or a handler.
+
+    rate: maximum number of events per second (None: no limit)
+    window: maximum number of events encrypted ahead of the one being sent
+    on_response: function called as on_response(index, plaintext) with the
+                 response of each request
+
+    Returns a Stats object.
+    """
+    if not connection.direct:
+        raise Error("Connection is not direct.")
+
+    if connection.to_input:
+        code, step = ReactiveCommand.RemoteOutput, 1
+    elif connection.to_handler:
+        code, step = ReactiveCommand.RemoteRequest, 2
+    else:
+        raise Error("Connection {} has no input nor handler".format(connection.name))
+
+    node = connection.to_module.node
+    base = connection.nonce
+    queue = asyncio.Queue(window)
+    errors = []
+    stats = Stats()
+
+    async def produce():
+        try:
+            index = 0
+            async for arg in _aiter(payloads):
+                nonce = base + index * step
+                if nonce + step - 1 > MAX_NONCE:
+                    raise Error("Nonces of connection {} exhausted".format(
+                                    connection.name))
+
+                command = await node.make_direct_command(code, connection,
+                                                         arg, nonce)
+                await queue.put((index, nonce, len(arg or b''), command))
+                index += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            errors.append(e)
+
+        await queue.put(None)
+
+    async def consume():
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+
+            index, nonce, size, command = item
+
+            if rate is not None:
+                delay = start + index / rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            sent = time.perf_counter()
+            response = await node._send_reactive_command(command)
+            stats.add(size, time.perf_counter() - sent)
+            connection.nonce = nonce + step
+
+            if response is not None and on_response is not None:
+                on_response(index,
+                    await node.decrypt_response(connection, response, nonce))
+
+    logging.info("Streaming on connection {}:{} from nonce {}".format(
+                    connection.id, connection.name, base))
+
+    start = time.perf_counter()
+    producer = asyncio.ensure_future(produce())
+
+    try:
+        await consume()
+    finally:
+        producer.cancel()
+        stats.elapsed = time.perf_counter() - start
+
+    if errors:
+        raise errors[0]
+
+    logging.info("Sent {} events in {:.3f}s".format(stats.count, stats.elapsed))
+    return stats
+
+
+# Payloads are hex strings, one per line. Lines are read in the pool of
+# blocking work, so that a slow input (e.g., stdin) does not block the event
+# loop
+async def read_payloads(f):
+    while True:
+        line = await tools.run_blocking(f.readline)
+        if not line:
+            return
+
+        line = line.strip()
+        if line:
+            try:
+                yield binascii.unhexlify(line)
+            except binascii.Error:
+                raise Error("Bad payload: {}".format(line))
+
+
+async def _aiter(payloads):
+    if hasattr(payloads, '__aiter__'):
+        async for payload in payloads:
+            yield payload
+    else:
+        for payload in payloads:
+            yield payload
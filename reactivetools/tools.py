@@ -3,11 +3,22 @@ import tempfile
 import os
 import asyncio
 import base64
+import concurrent.futures
+import contextvars
+import functools
+import re
+import shutil
 import struct
 from enum import Enum
 
 from . import glob
 
+# Pool of threads running the blocking work of coroutines (disk I/O, parsing
+# of ELF files, encryption, ...) off the event loop, see run_blocking
+BLOCKING_THREAD_PREFIX = "reactive-tools"
+
+__blocking_pool = None
+
 class ProcessRunError(Exception):
     def __init__(self, args, result):
         self.args = args
@@ -53,13 +64,45 @@ def init_future(*results):
     return fut
 
 
+def _get_blocking_pool():
+    global __blocking_pool
+
+    if __blocking_pool is None:
+        __blocking_pool = concurrent.futures.ThreadPoolExecutor(
+                            thread_name_prefix=BLOCKING_THREAD_PREFIX)
+
+    return __blocking_pool
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) in the pool of blocking work, without blocking
+    the event loop, and returns its result.
+
+    func runs in a copy of the current context, therefore it sees the
+    workspace, build dir, ... of the deployment that called it (see glob.py)
+    """
+    call = functools.partial(contextvars.copy_context().run, func,
+                             *args, **kwargs)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_get_blocking_pool(), call)
+
+
 async def run_async(*args, output_file=os.devnull, env=None):
     logging.debug(' '.join(args))
 
+    # build processes share the jobserver of the deployment, if any
+    jobserver = glob.get_jobserver()
+    pass_fds = ()
+    if jobserver is not None:
+        env = jobserver.get_env(env)
+        pass_fds = jobserver.fds
+
     process = await asyncio.create_subprocess_exec(*args,
                                             stdout=open(output_file, 'wb'),
                                             stderr=get_stderr(),
-                                            env=env)
+                                            env=env,
+                                            pass_fds=pass_fds)
     result = await process.wait()
 
     if result != 0:
@@ -105,15 +148,78 @@ async def run_async_shell(*args, env=None):
         raise ProcessRunError(args, result)
 
 
+async def run_cargo_build(*args, manifest, triple=None, name, binary, id):
+    """
+    Runs `cargo build` (args) on `manifest` for the target triple (None for
+    the host).
+
+    `binary` is the path of the binary `name` in the target dir of the crate.
+    If the target dir is shared (see glob.get_cargo_target_dir), the binary is
+    copied there from the shared one, where it would be overwritten by the
+    build of another module with the same crate name. `id` (e.g., the name of
+    the module) distinguishes such crates in the shared target dir.
+    """
+    target_dir = glob.get_cargo_target_dir(triple)
+
+    if target_dir is None:
+        async with glob.build_slot():
+            await run_async(*args)
+        return
+
+    await run_blocking(set_crate_build_metadata, manifest, id)
+
+    async with glob.cargo_lock(target_dir):
+        async with glob.build_slot():
+            await run_async(*args, "--target-dir", target_dir)
+
+        built = os.path.join(target_dir, triple or "",
+                             glob.get_build_mode().to_str(), name)
+        await run_blocking(_copy_file, built, binary)
+
+
+# Blocking, see run_blocking
+def _copy_file(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.copy2(src, dst)
+
+
+# Blocking, see run_blocking
+#
+# Cargo identifies a root crate by its name and version only, regardless of its
+# path: in a shared target dir, two crates with the same name and version are
+# the same crate, and the second one is not even rebuilt. The semver build
+# metadata of the version (e.g., 0.1.0+sm1) makes them different crates
+def set_crate_build_metadata(manifest, id):
+    import toml
+
+    cargo = toml.load(manifest)
+    version = cargo["package"]["version"]
+    metadata = re.sub(r'[^0-9A-Za-z-]', '-', id)
+
+    if version.endswith("+" + metadata) or version.endswith("." + metadata):
+        return
+
+    separator = "." if "+" in version else "+"
+    cargo["package"]["version"] = version + separator + metadata
+
+    with open(manifest, 'w') as f:
+        toml.dump(cargo, f)
+
+
+# Blocking, see run_blocking
 def create_tmp(suffix='', dir=''):
-    dir = os.path.join(glob.BUILD_DIR, dir)
+    dir = os.path.join(glob.get_build_dir(), dir)
     fd, path = tempfile.mkstemp(suffix=suffix, dir=dir)
     os.close(fd)
     return path
 
 
+async def create_tmp_async(suffix='', dir=''):
+    return await run_blocking(create_tmp, suffix, dir)
+
+
 def create_tmp_dir():
-    return tempfile.mkdtemp(dir=glob.BUILD_DIR)
+    return tempfile.mkdtemp(dir=glob.get_build_dir())
 
 
 def generate_key(length):
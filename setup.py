@@ -1,11 +1,13 @@
 import setuptools
 
+from reactivetools import __version__
+
 with open("README.md", "r", encoding="utf-8") as fh:
     long_description = fh.read()
 
 setuptools.setup(
     name="reactive-tools",
-    version="0.2.1",
+    version=__version__,
     author="Gianluca Scopelliti",
     author_email="gianlu.1033@gmail.com",
     description="Deployment tools for the Authentic Execution framework",
@@ -19,14 +21,16 @@ setuptools.setup(
         'pycryptodome==3.10.1',
         'reactive-net==0.2',
         'rust-sgx-gen==0.1.3',
-        'PyYAML==5.4.1'
+        'PyYAML==5.4.1',
+        'msgpack==1.0.2',
+        'toml==0.10.2'
     ],
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.8',
     include_package_data=True,
     entry_points={
         'console_scripts': ['reactive-tools = reactivetools.cli:main']